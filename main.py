@@ -5,8 +5,11 @@ from pathlib import Path
 
 import polars
 
+from logger import logger
 from logger.logger import INFO, ENDC, DEBUG, ERROR
-from src.plotter import plot_chart
+from src.analyzer import get_batch_chart_data, get_kpi_table
+from src.input_reader import append_input_files
+from src.output_writer import wait_for_outputs
 from src.settings import SETTINGS
 
 
@@ -44,23 +47,63 @@ def file_picker():
 def main():
     parser = argparse.ArgumentParser(description="Process a file path.")
     parser.add_argument(
-        "--file", required=False, type=Path, help="Path to the input file"
+        "--file", required=False, type=Path, help="Path to the input file, or to a folder of the dataset"
+    )
+    parser.add_argument(
+        "--append", required=False, type=Path,
+        help="Parsed file to add the files in the input folder to, as new actions of the same board"
+    )
+    parser.add_argument(
+        "--batch", required=False, type=str, help="Glob of parsed files to evaluate the KPIs on, board by board"
+    )
+    parser.add_argument(
+        "--no-plot", action="store_true",
+        help="Only compute the KPI table, printed and written as CSV, without loading the plotting libraries"
     )
 
     args = parser.parse_args()
 
-    if args.file is None:
+    if args.batch is not None:
+        batch_chart_data = get_batch_chart_data(pattern=args.batch, kpis=SETTINGS.KPIS)
+        SETTINGS.OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
+        print(batch_chart_data)
+        batch_chart_data.write_csv(SETTINGS.OUTPUT_FOLDER / f"batch_{SETTINGS.TIMESTAMP_LABEL}.csv")
+        return
+
+    if args.append is not None:
+        if not args.append.exists():
+            raise FileNotFoundError(f"File {args.append} does not exist.")
+        append_input_files(parsed_file=args.append)
+        args.file = args.append
+
+    # Headless runs never prompt, without a file they read the input folder
+    if args.file is None and not args.no_plot:
         args.file = file_picker()
 
     if args.file is not None and not args.file.exists():
         raise FileNotFoundError(f"File {args.file} does not exist.")
 
-    plot_chart(file=args.file)
+    if args.no_plot:
+        kpi_table = get_kpi_table(file=args.file)
+        print(kpi_table)
+        SETTINGS.OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
+        kpi_table.write_csv(SETTINGS.OUTPUT_FOLDER / f"kpis_{SETTINGS.TIMESTAMP_LABEL}.csv")
+    else:
+        # matplotlib takes longer to import than most headless runs take to finish
+        from src.plotter import plot_chart
+
+        plot_chart(file=args.file)
+    wait_for_outputs()
 
 
 if __name__ == "__main__":
     os.environ["POLARS_MAX_THREADS"] = "16"
     polars.Config.set_tbl_width_chars(300).set_fmt_table_cell_list_len(10)
+    # CPU time of the process so far, which is the interpreter starting up and importing the modules above
+    startup_time = time.process_time()
+    logger.debug(f"Started up in {startup_time:.3f} seconds")
+    if startup_time > SETTINGS.STARTUP_TIME_BUDGET:
+        logger.warning(f"Startup took {startup_time:.3f} seconds, over the budget of {SETTINGS.STARTUP_TIME_BUDGET} seconds")
     start = time.time()
     main()
     print(f"Finished in {time.time() - start:.3f} seconds")
@@ -1,117 +1,397 @@
+import hashlib
+from glob import glob
 from pathlib import Path
 
-import pandas
+import numpy
 import polars
 
 from logger import logger
-from src.input_reader import read_input_files
+from src.bitmap_index import BitmapIndex
+from src.dataset import get_board
+from src.input_reader import get_parsed_files, read_input_files, scan_parsed_file, scan_parsed_part
+from src.kpi_cache import get_cached, get_kpi_cache_keys, get_part_hash, load_kpi_cache, save_kpi_cache, set_cached
 from src.models.Action import Action
-from src.models.KPI import KPIRequirement, KPIOperation
+from src.models.Card import (
+    CARD_IDS,
+    RANK_COUNT_BITS,
+    RANK_COUNTS_GUARD,
+    RANK_ORDER,
+    Rank,
+    get_cards_mask,
+    get_rank_counts,
+    split_cards,
+)
+from src.models.ChartData import ChartData
+from src.models.InputColumn import InputColumn
+from src.models.KPI import KPI, KPIRequirement, KPIOperation
+from src.models.OutputColumn import OutputColumn
 from src.settings import SETTINGS
 
 
-def get_requirement_condition(dataframe: polars.DataFrame, requirement: KPIRequirement):
+def _rank_counts(schema: polars.Schema) -> polars.Expr:
+    if InputColumn.HOLE_CARDS_RANK_COUNTS in schema:
+        return polars.col(InputColumn.HOLE_CARDS_RANK_COUNTS)
+    # Files parsed before the column existed, or the distinct values of a bitmap index
+    return polars.sum_horizontal(
+        polars.col(InputColumn.HOLE_CARDS_RANKS).str.count_matches(rank, literal=True).cast(polars.UInt64)
+        * polars.lit(1 << (RANK_COUNT_BITS * index), dtype=polars.UInt64)
+        for index, rank in enumerate(RANK_ORDER)
+    )
+
+
+def get_includes_condition(schema: polars.Schema, requirement: KPIRequirement) -> polars.Expr:
+    """
+    Hole card ranks match when the hand holds at least as many cards of every rank as the value, in any order.
+    Every rank count of a hand gets its guard bit set and the count of the value taken away, without borrowing
+    from the next rank, so a rank with too few cards is the one that clears its guard bit.
+    Hole and community cards match when they hold every card of the value.
+    """
+    column = polars.col(requirement.column)
+    if requirement.column == InputColumn.HOLE_CARDS_RANKS:
+        rank_counts = get_rank_counts(str(requirement.value))
+        guard = polars.lit(RANK_COUNTS_GUARD, dtype=polars.UInt64)
+        return ((_rank_counts(schema) | guard) - polars.lit(rank_counts, dtype=polars.UInt64)) & guard == guard
+    elif requirement.column in (InputColumn.HOLE_CARDS, InputColumn.COMMUNITY_CARDS):
+        cards = split_cards(str(requirement.value))
+        if requirement.column == InputColumn.HOLE_CARDS and InputColumn.HOLE_CARDS_MASK in schema:
+            cards_mask = polars.lit(get_cards_mask(cards), dtype=polars.UInt64)
+            return polars.col(InputColumn.HOLE_CARDS_MASK) & cards_mask == cards_mask
+        dtype = schema[requirement.column]
+        if dtype.inner == polars.UInt8:
+            # Cards are stored by id
+            cards = [CARD_IDS[card] for card in cards]
+        contains = column.arr.contains if isinstance(dtype, polars.datatypes.Array) else column.list.contains
+        return polars.all_horizontal(contains(card) for card in cards)
+    elif isinstance(schema[requirement.column], polars.datatypes.List):
+        value = requirement.value
+        if schema[requirement.column].inner == polars.UInt8 and value in list(RANK_ORDER):
+            # Rank lists hold numbers, 2 to 14 for ace, so a rank can still be written as its character
+            value = RANK_ORDER.index(value) + Rank.TWO.value
+        return column.list.contains(value)
+    elif isinstance(schema[requirement.column], (polars.datatypes.String, polars.datatypes.Enum, polars.datatypes.Categorical)):
+        # Labels are stored as enums, and match on their text the same as strings do
+        return column.cast(polars.String).str.contains(requirement.value)
+    raise ValueError(f"Column {requirement.column} is not of type List or String. Cannot apply {requirement.operation} operation.")
+
+
+def get_requirement_condition(schema: polars.Schema, requirement: KPIRequirement) -> polars.Expr | None:
+    column = polars.col(requirement.column)
+    dtype = schema.get(requirement.column)
+    if (
+        isinstance(dtype, polars.datatypes.Enum)
+        and requirement.operation not in (KPIOperation.INCLUDES, KPIOperation.NOT_INCLUDES)
+        and requirement.value not in dtype.categories
+    ):
+        # Polars cannot compare an enum with a label it does not have
+        raise ValueError(
+            f"{requirement.value} is not a value of {requirement.column}, expected one of: {', '.join(dtype.categories)}"
+        )
     if requirement.operation == KPIOperation.EQUALS:
-        return dataframe[requirement.column] == requirement.value
+        return column == requirement.value
     elif requirement.operation == KPIOperation.NOT_EQUALS:
-        return dataframe[requirement.column] != requirement.value
+        return column != requirement.value
     elif requirement.operation == KPIOperation.GREATER_THAN:
-        return dataframe[requirement.column] > requirement.value
+        return column > requirement.value
     elif requirement.operation == KPIOperation.GREATER_THAN_OR_EQUALS:
-        return dataframe[requirement.column] >= requirement.value
+        return column >= requirement.value
     elif requirement.operation == KPIOperation.LESS_THAN:
-        return dataframe[requirement.column] < requirement.value
+        return column < requirement.value
     elif requirement.operation == KPIOperation.LESS_THAN_OR_EQUALS:
-        return dataframe[requirement.column] <= requirement.value
+        return column <= requirement.value
     elif requirement.operation == KPIOperation.INCLUDES:
-        if isinstance(dataframe[requirement.column].dtype, polars.datatypes.List):
-            return dataframe[requirement.column].list.contains(requirement.value)
-        elif isinstance(dataframe[requirement.column].dtype, polars.datatypes.String):
-            return dataframe[requirement.column].str.contains(requirement.value)
-        else:
-            raise ValueError(f"Column {requirement.column} is not of type List or String. Cannot apply INCLUDES operation.")
+        return get_includes_condition(schema=schema, requirement=requirement)
     elif requirement.operation == KPIOperation.NOT_INCLUDES:
-        if isinstance(dataframe[requirement.column].dtype, polars.datatypes.List):
-            return ~dataframe[requirement.column].list.contains(requirement.value)
-        elif isinstance(dataframe[requirement.column].dtype, polars.datatypes.String):
-            return ~dataframe[requirement.column].str.contains(requirement.value)
-        else:
-            raise ValueError(f"Column {requirement.column} is not of type List or String. Cannot apply NOT_INCLUDES operation.")
+        return ~get_includes_condition(schema=schema, requirement=requirement)
     return None
 
 
-def apply_requirement(dataframe: polars.DataFrame, requirement: KPIRequirement) -> polars.DataFrame:
-    requirement_condition = get_requirement_condition(dataframe=dataframe, requirement=requirement)
-    return dataframe.filter(requirement_condition)
+def get_kpi_condition(schema: polars.Schema, kpi: KPI) -> polars.Expr:
+    if not kpi.requirements:
+        return polars.lit(True)
+    try:
+        return polars.all_horizontal(
+            get_requirement_condition(schema=schema, requirement=requirement) for requirement in kpi.requirements
+        )
+    except ValueError as error:
+        raise ValueError(f"Invalid requirement in KPI {kpi.display_name}: {error}") from error
+
+
+def assign_kpis(dataframe: polars.LazyFrame, kpis: list[KPI]) -> polars.LazyFrame:
+    """
+    Keeps the rows that match any KPI, tagged with the index of the first KPI they match.
+    A row counts towards a single KPI, the same as taking the rows of every KPI out before checking the next one.
+    """
+    schema = dataframe.collect_schema()
+    conditions = []
+    for kpi in kpis:
+        logger.info(f"Processing KPI: {kpi.display_name}")
+        for requirement in kpi.requirements:
+            logger.info(f"Processing requirement: {requirement}")
+        conditions.append(get_kpi_condition(schema=schema, kpi=kpi))
+    if not conditions:
+        return dataframe.filter(polars.lit(False)).with_columns(polars.lit(None, dtype=polars.UInt32).alias("kpi_index"))
+
+    kpi_index = polars
+    for index, condition in enumerate(conditions):
+        kpi_index = kpi_index.when(condition).then(index)
+    # Filtering on the plain conditions first lets a parquet scan skip the row groups that cannot match any KPI
+    return dataframe.filter(polars.any_horizontal(conditions)).with_columns(
+        kpi_index.otherwise(None).cast(polars.UInt32).alias("kpi_index")
+    )
+
+
+def get_kpi_weights(dataframe: polars.LazyFrame, kpis: list[KPI]) -> dict[int, dict[str, float]]:
+    """
+    Weight of every action for every KPI that matched at least one row, keyed by KPI index.
+    Only the columns the KPIs reference are read.
+    """
+    weights = (
+        assign_kpis(dataframe=dataframe, kpis=kpis)
+        .group_by(["kpi_index", "action"])
+        .agg(polars.col("weight").sum(), polars.len().alias("rows"))
+        .collect()
+    )
+    for kpi_index, rows in weights.group_by("kpi_index").agg(polars.col("rows").sum()).sort("kpi_index").rows():
+        logger.info(f"Rows that match {kpis[kpi_index].display_name}: {rows}")
+
+    weights = weights.with_columns(polars.col("action").cast(polars.String)).pivot(
+        on="action", index="kpi_index", values="weight"
+    )
+    return {row.pop("kpi_index"): row for row in weights.fill_null(0).to_dicts()}
+
+
+def get_kpi_weights_from_index(index: BitmapIndex, kpis: list[KPI]) -> dict[int, dict[str, float]]:
+    """
+    Same as get_kpi_weights, answered with bitmap operations and the weight column alone.
+    """
+    action_rows = {
+        action: index.get_rows(index.get_bitmap(column="action", condition=polars.col("action") == action))
+        for action in index.values["action"].cast(polars.String)
+    }
+    remaining = index.all_rows()
+    kpi_weights = {}
+    for kpi_index, kpi in enumerate(kpis):
+        logger.info(f"Processing KPI: {kpi.display_name}")
+        matches = remaining.copy()
+        for requirement in kpi.requirements:
+            logger.info(f"Processing requirement: {requirement}")
+            try:
+                # Conditions are tested on the distinct values of the column alone
+                condition = get_requirement_condition(
+                    schema=polars.Schema({requirement.column: index.schema[requirement.column]}),
+                    requirement=requirement,
+                )
+            except ValueError as error:
+                raise ValueError(f"Invalid requirement in KPI {kpi.display_name}: {error}") from error
+            matches &= index.get_bitmap(column=requirement.column, condition=condition)
+        remaining &= ~matches
+        rows = index.get_rows(matches)
+        logger.info(f"Rows that match {kpi.display_name}: {rows.sum()}")
+        if rows.any():
+            kpi_weights[kpi_index] = {
+                action: float(index.weights[rows & action_rows[action]].sum(dtype=numpy.float64))
+                for action in action_rows
+            }
+    return kpi_weights
+
+
+def get_kpi_results(
+    dataframe: polars.LazyFrame,
+    file: Path | None,
+    kpis: list[KPI],
+) -> tuple[list[str], float, dict[int, dict[str, float]]]:
+    """
+    Actions, total weight and the weight of every action for every KPI that matched at least one row.
+    """
+    # Every fragment of a parsed file has an index of its own, rows never span fragments so their results add up
+    indexes = [BitmapIndex.load(part) for part in get_parsed_files(file)] if file is not None else []
+    requirement_columns = [requirement.column for kpi in kpis for requirement in kpi.requirements]
+    if indexes and all(index is not None and index.covers(requirement_columns) for index in indexes):
+        logger.info(f"Answering KPIs from the bitmap indexes of: {file}")
+        actions = []
+        total_weight = 0.0
+        kpi_weights = {}
+        for index in indexes:
+            actions += [action for action in index.values["action"].cast(polars.String) if action not in actions]
+            total_weight += float(index.weights.sum())
+            for kpi_index, weights in get_kpi_weights_from_index(index=index, kpis=kpis).items():
+                kpi_action_weights = kpi_weights.setdefault(kpi_index, {})
+                for action, weight in weights.items():
+                    kpi_action_weights[action] = kpi_action_weights.get(action, 0) + weight
+        return actions, total_weight, kpi_weights
+
+    totals = dataframe.select(
+        polars.col("action").unique(maintain_order=True).cast(polars.String).implode(),
+        polars.col("weight").sum(),
+    ).collect()
+    kpi_weights = get_kpi_weights(dataframe=dataframe, kpis=kpis)
+    return totals["action"].item().to_list(), totals["weight"].item(), kpi_weights
 
 
-def get_chart_data(file: Path = None) -> (pandas.DataFrame, pandas.DataFrame | None):
+def get_fingerprint(file: Path, kpi_cache: dict[str, dict]) -> str:
+    hashes = [get_part_hash(kpi_cache=kpi_cache, part=part) for part in get_parsed_files(file)]
+    if len(hashes) == 1:
+        return hashes[0]
+    return hashlib.sha256(":".join(hashes).encode()).hexdigest()
+
+
+def get_cached_kpi_results(
+    dataframe: polars.LazyFrame,
+    file: Path,
+    kpis: list[KPI],
+) -> tuple[list[str], float, dict[int, dict[str, float]]]:
+    """
+    Same as get_kpi_results, only computing the KPIs that are new or come after one that changed.
+    """
+    kpi_cache = load_kpi_cache()
+    fingerprint = get_fingerprint(file=file, kpi_cache=kpi_cache)
+    totals_key = f"{fingerprint}:totals"
+    kpi_keys = get_kpi_cache_keys(fingerprint=fingerprint, kpis=kpis)
+    missing = [kpi_index for kpi_index, key in enumerate(kpi_keys) if key not in kpi_cache]
+    logger.info(f"KPI cache: {len(kpis) - len(missing)} cached, {len(missing)} to compute")
+    if missing or totals_key not in kpi_cache:
+        # KPIs after the last missing one play no part in its result
+        kpis_to_compute = kpis[:missing[-1] + 1] if missing else []
+        actions, total_weight, kpi_weights = get_kpi_results(dataframe=dataframe, file=file, kpis=kpis_to_compute)
+        set_cached(kpi_cache=kpi_cache, key=totals_key, value={"actions": actions, "total_weight": total_weight})
+        for kpi_index in missing:
+            set_cached(kpi_cache=kpi_cache, key=kpi_keys[kpi_index], value=kpi_weights.get(kpi_index))
+
+    totals = get_cached(kpi_cache=kpi_cache, key=totals_key)
+    kpi_weights = {}
+    for kpi_index, key in enumerate(kpi_keys):
+        weights = get_cached(kpi_cache=kpi_cache, key=key)
+        if weights is not None:
+            kpi_weights[kpi_index] = weights
+    save_kpi_cache(kpi_cache)
+    return totals["actions"], totals["total_weight"], kpi_weights
+
+
+def load_kpi_results(file: Path = None) -> tuple[list[str], float, dict[int, dict[str, float]]]:
+    """
+    KPI results of a parsed file, or of the files in the input folder when there is none.
+    """
     if file is not None:
-        dataframe = polars.read_parquet(file)
-        if dataframe is None:
-            raise Exception(f"File {file} is empty or invalid.")
+        dataframe = scan_parsed_file(file)
     else:
-        dataframe = read_input_files()
+        dataframe = read_input_files(lazy=SETTINGS.STREAM_INPUT_FILES)
         if dataframe is None:
             raise Exception("No valid files found in the input folder.")
+        dataframe = dataframe.lazy()
 
-    base_dataframe = dataframe.clone()
+    if file is not None and SETTINGS.KPI_CACHE:
+        return get_cached_kpi_results(dataframe=dataframe, file=file, kpis=SETTINGS.KPIS)
+    return get_kpi_results(dataframe=dataframe, file=file, kpis=SETTINGS.KPIS)
 
-    general_bar_chart = {}
-    bet_line_chart = {}
-    actions = dataframe["action"].unique().to_list()
-    bet_actions = list(filter(
-        lambda x: x in actions,
-        [Action.BET.value] + [Action(f"bet{i}").value for i in range(1, 101)],
-    ))
-    total_weight = dataframe["weight"].sum()
-    for kpi in SETTINGS.KPIS:
-        logger.info(f"Processing KPI: {kpi.display_name}")
-        start_dataframe = dataframe.clone()
 
-        for requirement in kpi.requirements:
-            logger.info(f"Processing requirement: {requirement} on {dataframe.shape[0]} rows")
-            dataframe = apply_requirement(dataframe=dataframe, requirement=requirement)
-            logger.info(f"Rows that match requirement: {dataframe.shape[0]}")
-
-        if dataframe.shape[0] == 0:
-            logger.warning("No rows match the KPI requirements.")
-            general_bar_chart[kpi.display_name] = {action: 0 for action in actions}
-            bet_line_chart[kpi.display_name] = {action: 0 for action in bet_actions}
-            dataframe = start_dataframe
-            continue
+def get_kpi_table(file: Path = None) -> polars.DataFrame:
+    """
+    Weight of every action for every KPI that matched at least one row, percentages are of the total weight.
+    Same columns as get_batch_chart_data without the board, for runs that skip the charts.
+    """
+    actions, total_weight, kpi_weights = load_kpi_results(file=file)
+    return polars.DataFrame(
+        [
+            (kpi.display_name, action, kpi_weights[kpi_index].get(action, 0.0))
+            for kpi_index, kpi in enumerate(SETTINGS.KPIS)
+            if kpi_index in kpi_weights
+            for action in actions
+        ],
+        schema={OutputColumn.KPI_NAME: polars.String, "action": polars.String, "weight": polars.Float64},
+        orient="row",
+    ).with_columns((polars.col("weight") / total_weight * 100).alias(OutputColumn.PERCENTAGE))
 
-        weight_by_action = {}
-        for action in actions:
-            weight_by_action[action] = dataframe.filter(dataframe["action"] == action)["weight"].sum()
 
-        general_bar_chart[kpi.display_name] = {}
-        bet_line_chart[kpi.display_name] = {}
-        for action, weight in weight_by_action.items():
-            percentage = (weight / total_weight) * 100
-            general_bar_chart[kpi.display_name][action] = percentage
-            logger.info(f"Percentage of {action}: {percentage:.2f}%")
+def get_chart_shares(percentages: numpy.ndarray, actions: list[str], matched: numpy.ndarray) -> ChartData:
+    """
+    Rows of the KPIs that matched are scaled to add up to one, and labelled with the percentage of the total weight
+    they held. KPIs that matched no rows keep their zeros and their plain name.
+    """
+    totals = percentages.sum(axis=1)
+    # A KPI whose rows all weigh nothing has no shares to show, only NaN
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        values = numpy.where(matched[:, None], percentages / totals[:, None], percentages)
+    labels = [
+        f"{kpi.display_name}\n{total:.2f}%" if is_matched else kpi.display_name
+        for kpi, total, is_matched in zip(SETTINGS.KPIS, totals, matched)
+    ]
+    return ChartData(labels=labels, actions=actions, values=values)
 
-            if action in bet_actions:
-                bet_line_chart[kpi.display_name][action] = percentage
 
-        total_percentage = sum(general_bar_chart[kpi.display_name].values())
-        for action in actions:
-            general_bar_chart[kpi.display_name][action] /= total_percentage
+def get_chart_data(file: Path = None) -> tuple[ChartData, ChartData | None]:
+    """
+    Share of every action within each KPI, and of every bet size within the bets of each KPI.
+    The bet chart is None when no bet was made.
+    """
+    actions, total_weight, kpi_weights = load_kpi_results(file=file)
 
-        bet_total_percentage = sum(bet_line_chart[kpi.display_name].values())
-        for action in bet_actions:
-            bet_line_chart[kpi.display_name][action] /= bet_total_percentage
+    percentages = numpy.zeros((len(SETTINGS.KPIS), len(actions)))
+    for kpi_index, kpi in enumerate(SETTINGS.KPIS):
+        if kpi_index not in kpi_weights:
+            logger.warning(f"No rows match the KPI requirements of {kpi.display_name}.")
+            continue
+        percentages[kpi_index] = [kpi_weights[kpi_index].get(action, 0) / total_weight * 100 for action in actions]
+        for action, percentage in zip(actions, percentages[kpi_index]):
+            logger.info(f"Percentage of {action}: {percentage:.2f}%")
+    matched = numpy.array([kpi_index in kpi_weights for kpi_index in range(len(SETTINGS.KPIS))], dtype=bool)
 
-        general_bar_chart[f"{kpi.display_name}\n{total_percentage:.2f}%"] = general_bar_chart[kpi.display_name]
-        del general_bar_chart[kpi.display_name]
+    general_bar_chart = get_chart_shares(percentages=percentages, actions=actions, matched=matched)
+    bet_actions = list(filter(
+        lambda x: x in actions,
+        [Action.BET.value] + [Action(f"bet{i}").value for i in range(1, 101)],
+    ))
+    if not bet_actions:
+        return general_bar_chart, None
+    bet_columns = [actions.index(action) for action in bet_actions]
+    bet_line_chart = get_chart_shares(percentages=percentages[:, bet_columns], actions=bet_actions, matched=matched)
+    return general_bar_chart, bet_line_chart
 
-        bet_line_chart[f"{kpi.display_name}\n{bet_total_percentage:.2f}%"] = bet_line_chart[kpi.display_name]
-        del bet_line_chart[kpi.display_name]
 
-        dataframe = base_dataframe.join(dataframe, on=base_dataframe.columns, how="anti")
+def get_batch_chart_data(pattern: str, kpis: list[KPI]) -> polars.DataFrame:
+    """
+    Weight of every action for every KPI on every board, over all parsed files matching the glob pattern.
+    All files and their fragments go through a single scan, percentages are of the total weight of the board.
+    Every parse writes a new file, so an action of a board found in more than one matching part
+    is only counted from the newest of them.
+    """
+    # A parsed file brings its fragments, a dataset folder its partitions, each part is only scanned once
+    parts = list(dict.fromkeys(
+        part for match in sorted(glob(pattern, recursive=True)) for part in get_parsed_files(Path(match))
+    ))
+    if not parts:
+        raise FileNotFoundError(f"No parsed files match: {pattern}")
+    parts.sort(key=lambda part: part.stat().st_mtime_ns)  # Oldest first, so the newest part has the highest index
 
+    dataframe = polars.concat([
+        scan_parsed_part(part).with_columns(polars.lit(part_index, dtype=polars.UInt32).alias("part"))
+        for part_index, part in enumerate(parts)
+    ]).with_columns(
+        get_board(polars.col("community_cards")).alias("board")
+    )
+    action_parts = dataframe.group_by(["board", "action"]).agg(polars.col("part").unique()).collect()
+    for board, action, action_part_indices in action_parts.iter_rows():
+        if len(action_part_indices) > 1:
+            logger.warning(
+                f"Action {action} of board {board} is in {len(action_part_indices)} parsed files, "
+                f"only counting the newest: {parts[max(action_part_indices)]}"
+            )
+    newest_parts = action_parts.select("board", "action", polars.col("part").list.max())
+    dataframe = dataframe.join(newest_parts.lazy(), on=["board", "action", "part"], how="semi")
+    totals = dataframe.group_by("board").agg(polars.col("weight").sum().alias("total_weight"))
+    kpi_names = {kpi_index: kpi.display_name for kpi_index, kpi in enumerate(kpis)}
     return (
-        polars.DataFrame(general_bar_chart).to_pandas(),
-        polars.DataFrame(bet_line_chart).to_pandas() if bet_line_chart else None,
+        assign_kpis(dataframe=dataframe, kpis=kpis)
+        .group_by(["board", "kpi_index", "action"])
+        .agg(polars.col("weight").sum())
+        .join(totals, on="board")
+        .with_columns(polars.col("action").cast(polars.String))
+        .sort(["board", "kpi_index", "action"])
+        .select(
+            "board",
+            polars.col("kpi_index").replace_strict(kpi_names, return_dtype=polars.String).alias(OutputColumn.KPI_NAME),
+            "action",
+            "weight",
+            (polars.col("weight") / polars.col("total_weight") * 100).alias(OutputColumn.PERCENTAGE),
+        )
+        .collect()
     )
@@ -0,0 +1,139 @@
+import json
+import os
+import time
+from functools import cached_property
+from pathlib import Path
+
+import numpy
+import polars
+
+from logger import logger
+
+# Low cardinality columns, every distinct value gets a bitmap of the rows that hold it
+INDEXED_COLUMNS = [
+    "action",
+    "hole_cards_ranks",
+    "is_flush",
+    "is_straight",
+    "is_straight_flush",
+    "is_pair",
+    "is_two_pair",
+    "is_trips",
+    "is_quads",
+    "is_full_house",
+    "pair_rank",
+    "flush_rank",
+    "straight_rank",
+    "best_hand_value",
+    "flush_draw",
+    "draw_straight_outs",
+]
+
+
+# Like roaring bitmaps, columns with many values keep the sorted row ids of each value instead of a bitmap per value
+MAX_BITMAP_VALUES = 32
+
+
+def get_index_path(file: Path) -> Path:
+    return file.with_suffix(".index")
+
+
+def write_bitmap_index(file: Path) -> None:
+    """
+    Writes the sidecar bitmap index of a parsed parquet file into a folder next to it.
+    Low cardinality columns get one bitmap per value, packed 8 rows to a byte.
+    Others get the ids of the rows of every value back to back, plus where each value starts.
+    """
+    logger.debug(f"Writing bitmap index for: {file}")
+    start = time.time()
+    dataframe = polars.read_parquet(file, columns=INDEXED_COLUMNS)
+    index_path = get_index_path(file)
+    index_path.mkdir(exist_ok=True)
+    # The metadata goes last and marks the index as complete, readers ignore an index without it
+    (index_path / "metadata.json").unlink(missing_ok=True)
+    values_by_column = {}
+    for column in INDEXED_COLUMNS:
+        values = dataframe[column].unique(maintain_order=True).drop_nulls()
+        values_by_column[column] = values.to_list()
+        codes = (
+            dataframe.select(column)
+            .join(values.to_frame().with_row_index("code"), on=column, how="left", maintain_order="left")["code"]
+            .fill_null(len(values))  # Rows with a null get a code of their own, which no value points to
+            .to_numpy()
+        )
+        if len(values) <= MAX_BITMAP_VALUES:
+            bitmaps = numpy.zeros((len(values) + 1, dataframe.height), dtype=bool)
+            bitmaps[codes, numpy.arange(dataframe.height)] = True
+            numpy.save(index_path / f"{column}.bitmaps.npy", numpy.packbits(bitmaps[:-1], axis=1))
+        else:
+            rows_by_code = numpy.argsort(codes, kind="stable").astype(numpy.uint32)
+            bounds = numpy.searchsorted(codes[rows_by_code], numpy.arange(len(values) + 1))
+            numpy.save(index_path / f"{column}.rows.npy", rows_by_code[:bounds[-1]])
+            numpy.save(index_path / f"{column}.bounds.npy", bounds)
+    stat = file.stat()
+    metadata = {"rows": dataframe.height, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "values": values_by_column}
+    (index_path / "metadata.json.tmp").write_text(json.dumps(metadata))
+    os.replace(index_path / "metadata.json.tmp", index_path / "metadata.json")
+    logger.debug(f"Done in {time.time() - start:.2f} seconds")
+
+
+class BitmapIndex:
+    def __init__(self, file: Path):
+        self.file = file
+        self.path = get_index_path(file)
+        metadata = json.loads((self.path / "metadata.json").read_text())
+        self.rows = metadata["rows"]
+        self.size = metadata["size"]
+        self.mtime_ns = metadata["mtime_ns"]
+        self.schema = polars.scan_parquet(file).collect_schema()
+        self.values = {
+            column: polars.Series(column, values, dtype=self.schema[column])
+            for column, values in metadata["values"].items()
+        }
+
+    @classmethod
+    def load(cls, file: Path) -> "BitmapIndex | None":
+        """
+        Returns the index of a parsed parquet file, or None if it has none or the file changed since it was written.
+        """
+        if not (get_index_path(file) / "metadata.json").exists():
+            return None
+        index = cls(file)
+        stat = file.stat()
+        if (index.size, index.mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            logger.warning(f"Ignoring outdated bitmap index of: {file}")
+            return None
+        return index
+
+    def covers(self, columns: list[str]) -> bool:
+        return all(column in self.values for column in columns)
+
+    def all_rows(self) -> numpy.ndarray:
+        return numpy.packbits(numpy.ones(self.rows, dtype=bool))
+
+    def get_bitmap(self, column: str, condition: polars.Expr) -> numpy.ndarray:
+        """
+        Bitmap of the rows where the condition holds, found by testing the distinct values and OR-ing their rows.
+        Rows with a null never match, the same as when filtering the frame.
+        """
+        matches = self.values[column].to_frame().select(condition.fill_null(False)).to_series().to_numpy()
+        codes = numpy.flatnonzero(matches)
+        # Arrays are memory mapped, so only the pages of the matching values are read
+        bitmaps_path = self.path / f"{column}.bitmaps.npy"
+        if bitmaps_path.exists():
+            bitmaps = numpy.load(bitmaps_path, mmap_mode="r")
+            return numpy.bitwise_or.reduce(bitmaps[codes], axis=0, initial=0)
+
+        rows = numpy.load(self.path / f"{column}.rows.npy", mmap_mode="r")
+        bounds = numpy.load(self.path / f"{column}.bounds.npy")
+        bitmap = numpy.zeros(self.rows, dtype=bool)
+        for code in codes:
+            bitmap[rows[bounds[code]:bounds[code + 1]]] = True
+        return numpy.packbits(bitmap)
+
+    def get_rows(self, bitmap: numpy.ndarray) -> numpy.ndarray:
+        return numpy.unpackbits(bitmap, count=self.rows).astype(bool)
+
+    @cached_property
+    def weights(self) -> numpy.ndarray:
+        return polars.read_parquet(self.file, columns=["weight"])["weight"].to_numpy()
@@ -0,0 +1,73 @@
+import shutil
+import time
+from pathlib import Path
+
+import polars
+
+from logger import logger
+from src.bitmap_index import write_bitmap_index
+from src.models.Card import CARD_NAMES
+from src.settings import SETTINGS
+
+# Sorting a partition by these keeps the min and max of every row group narrow, so filters on them skip row groups
+DATASET_SORT_COLUMNS = ["best_hand_value", "hole_cards_ranks"]
+
+
+def get_dataset_folder() -> Path:
+    return SETTINGS.OUTPUT_FOLDER / "dataset"
+
+
+def get_partition_path(board: str, action: str) -> Path:
+    return get_dataset_folder() / f"board={board}" / f"action={action}" / "data.parquet"
+
+
+def get_board(community_cards: polars.Expr) -> polars.Expr:
+    return community_cards.list.eval(
+        polars.element().replace_strict(CARD_NAMES, return_dtype=polars.String)
+    ).list.join("")
+
+
+def write_dataset(dataframe: polars.DataFrame | polars.LazyFrame) -> list[Path]:
+    """
+    Writes parsed output into the dataset folder, hive style, one partition per board and action.
+    A partition that is written again is replaced as a whole.
+    The files keep the columns of a parsed file, so partitions and parsed files can be scanned together,
+    the board is read back from the partition path by scan_dataset.
+    """
+    logger.debug(f"Writing dataset partitions to: {get_dataset_folder()}")
+    start = time.time()
+    dataframe = dataframe.lazy().with_columns(get_board(polars.col("community_cards")).alias("board"))
+    keys = dataframe.select("board", polars.col("action").cast(polars.String)).unique().collect()
+    partition_paths = []
+    sinks = []
+    for board, action in keys.iter_rows():
+        partition_path = get_partition_path(board=board, action=action)
+        shutil.rmtree(partition_path.parent, ignore_errors=True)
+        partition_path.parent.mkdir(parents=True)
+        partition_paths.append(partition_path)
+        sinks.append(
+            dataframe.filter(polars.col("board") == board, polars.col("action").cast(polars.String) == action)
+            .drop("board")
+            .sort(DATASET_SORT_COLUMNS)
+            .sink_parquet(
+                partition_path,
+                row_group_size=SETTINGS.DATASET_ROW_GROUP_SIZE,
+                statistics="full",
+                lazy=True,
+            )
+        )
+    # The in-memory engine writes each partition as a single row group, whatever the row group size
+    polars.collect_all(sinks, engine="streaming")
+    if SETTINGS.SAVE_BITMAP_INDEX:
+        for partition_path in partition_paths:
+            write_bitmap_index(partition_path)
+    logger.debug(f"Done in {time.time() - start:.2f} seconds")
+    return partition_paths
+
+
+def scan_dataset(path: Path) -> polars.LazyFrame:
+    """
+    Scans the dataset folder or any partition of it. Filters on board and action prune whole partitions,
+    filters on the sort columns prune row groups through their statistics.
+    """
+    return polars.scan_parquet(path / "**" / "*.parquet", hive_partitioning=True)
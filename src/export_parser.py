@@ -0,0 +1,115 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy
+import polars
+
+from logger import logger
+from src.models.Card import RANK_COUNT, RANK_ORDER, Suit
+
+# Every line of a solver export is "weight:cards", with the four hole cards written as rank and suit characters
+HOLE_CARD_CHARACTERS = 8
+CHUNK_LINES = 1 << 18
+INVALID = 255
+MAX_WEIGHT_CHARACTERS = 16  # Every integer of 15 digits is exact in a float64
+
+RANK_LOOKUP = numpy.full(256, INVALID, dtype=numpy.uint8)
+RANK_LOOKUP[[ord(rank) for rank in RANK_ORDER]] = numpy.arange(RANK_COUNT)
+SUIT_LOOKUP = numpy.full(256, INVALID, dtype=numpy.uint8)
+SUIT_LOOKUP[[ord(suit) for suit in Suit]] = numpy.arange(len(Suit))
+
+
+def get_line_bounds(buffer: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Start and end of every non-empty line, line breaks left out.
+    """
+    line_ends = numpy.flatnonzero(buffer == ord("\n"))
+    if not len(buffer) or buffer[-1] != ord("\n"):
+        line_ends = numpy.append(line_ends, len(buffer))
+    line_starts = numpy.concatenate(([0], line_ends[:-1] + 1))
+    line_ends = line_ends - (buffer[numpy.maximum(line_ends - 1, 0)] == ord("\r"))
+    non_empty = line_ends > line_starts
+    return line_starts[non_empty], line_ends[non_empty]
+
+
+def parse_weights(buffer: numpy.ndarray, starts: numpy.ndarray, ends: numpy.ndarray) -> numpy.ndarray | None:
+    """
+    Reads plain decimal weights, like 1 or 0.2551, digit by digit. Returns None for anything else.
+    Weights of one length with the dot in one place share a layout, which turns their digits into an integer
+    with a single product, and the weights into floats with a single division by a power of ten.
+    """
+    lengths = ends - starts
+    if (lengths <= 0).any() or lengths.max() > MAX_WEIGHT_CHARACTERS:
+        return None
+    weights = numpy.empty(len(starts), dtype=numpy.float64)
+    for length in numpy.unique(lengths):
+        rows = numpy.flatnonzero(lengths == length)
+        characters = buffer[starts[rows, None] + numpy.arange(length)]
+        is_dot = characters == ord(".")
+        dots = numpy.where(is_dot.any(axis=1), is_dot.argmax(axis=1), length)
+        for dot in numpy.unique(dots):
+            layout_rows = numpy.flatnonzero(dots == dot)
+            # Anything but a digit, a second dot included, wraps around to more than 9
+            digits = characters[layout_rows][:, numpy.arange(length) != dot] - numpy.uint8(ord("0"))
+            if (digits > 9).any():
+                return None
+            powers = 10.0 ** numpy.arange(digits.shape[1] - 1, -1, -1)
+            weights[rows[layout_rows]] = (digits @ powers) / 10.0 ** max(length - dot - 1, 0)
+    return weights
+
+
+def parse_chunk(
+    buffer: numpy.ndarray, starts: numpy.ndarray, ends: numpy.ndarray
+) -> tuple[numpy.ndarray, numpy.ndarray] | None:
+    separators = ends - HOLE_CARD_CHARACTERS - 1
+    if (separators < starts).any() or (buffer[separators] != ord(":")).any():
+        return None
+
+    characters = buffer[(separators + 1)[:, None] + numpy.arange(HOLE_CARD_CHARACTERS)]
+    ranks = RANK_LOOKUP[characters[:, 0::2]]
+    suits = SUIT_LOOKUP[characters[:, 1::2]]
+    if (ranks == INVALID).any() or (suits == INVALID).any():
+        return None
+
+    weights = parse_weights(buffer=buffer, starts=starts, ends=separators)
+    if weights is None:
+        return None
+    return weights, suits * RANK_COUNT + ranks
+
+
+def parse_export(path: Path, head: int = None) -> polars.DataFrame | None:
+    """
+    Parses a solver export straight into a Float32 weight and the card ids of the hole cards.
+    The file is memory mapped and split into chunks of lines that are parsed side by side.
+    Returns None when a line does not follow the format, so the caller can fall back to the CSV reader.
+    """
+    logger.debug(f"Parsing export: {path}")
+    start = time.time()
+    if not path.stat().st_size:
+        return None
+    buffer = numpy.memmap(path, dtype=numpy.uint8, mode="r")
+    line_starts, line_ends = get_line_bounds(buffer)
+    if head:
+        line_starts, line_ends = line_starts[:head], line_ends[:head]
+    if not len(line_starts):
+        return None
+
+    chunks = [
+        (line_starts[offset:offset + CHUNK_LINES], line_ends[offset:offset + CHUNK_LINES])
+        for offset in range(0, len(line_starts), CHUNK_LINES)
+    ]
+    # numpy lets go of the GIL inside its loops, so threads parse chunks in parallel
+    with ThreadPoolExecutor(max_workers=min(len(chunks), os.cpu_count() or 1)) as executor:
+        results = list(executor.map(lambda chunk: parse_chunk(buffer, *chunk), chunks))
+    if any(result is None for result in results):
+        logger.warning(f"Unexpected line format, falling back to the CSV reader for: {path}")
+        return None
+
+    dataframe = polars.DataFrame({
+        "weight": numpy.concatenate([weights for weights, _ in results]).astype(numpy.float32),
+        "hole_cards": numpy.concatenate([cards for _, cards in results]).astype(numpy.uint8),
+    }).with_columns(polars.col("hole_cards").cast(polars.List(polars.UInt8)))
+    logger.debug(f"Done in {time.time() - start:.2f} seconds")
+    return dataframe
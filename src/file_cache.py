@@ -0,0 +1,87 @@
+import hashlib
+import json
+from pathlib import Path
+
+from logger import logger
+from src.models.File import File
+from src.settings import SETTINGS
+
+# Bump whenever the output of the input_reader pipeline changes, so shards built by older code are not reused
+PIPELINE_VERSION = 3
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def get_manifest_path() -> Path:
+    return SETTINGS.OUTPUT_FOLDER / "file_cache_manifest.json"
+
+
+def get_shard_folder() -> Path:
+    return SETTINGS.OUTPUT_FOLDER / "file_cache"
+
+
+def get_shard_path(entry: dict) -> Path:
+    return get_shard_folder() / entry["shard"]
+
+
+def hash_file(path: Path) -> str:
+    file_hash = hashlib.sha256()
+    with path.open("rb") as stream:
+        while chunk := stream.read(HASH_CHUNK_SIZE):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def load_manifest() -> dict[str, dict]:
+    """
+    Returns the cache entries by input file path.
+    Entries written by a different pipeline version are dropped along with their shards.
+    """
+    manifest_path = get_manifest_path()
+    if not manifest_path.exists():
+        return {}
+    manifest = json.loads(manifest_path.read_text())
+    if manifest.get("pipeline_version") == PIPELINE_VERSION:
+        return manifest["files"]
+
+    logger.info(f"Discarding file cache built by pipeline version {manifest.get('pipeline_version')}")
+    for entry in manifest.get("files", {}).values():
+        get_shard_path(entry).unlink(missing_ok=True)
+    return {}
+
+
+def save_manifest(manifest: dict[str, dict]) -> None:
+    get_manifest_path().write_text(json.dumps({"pipeline_version": PIPELINE_VERSION, "files": manifest}, indent=2))
+
+
+def get_cache_entry(file: File, manifest: dict[str, dict], head: int = None) -> dict:
+    stat = file.path.stat()
+    previous_entry = manifest.get(str(file.path.resolve()), {})
+    # Only re-hash files that were touched since they were cached
+    if previous_entry.get("size") == stat.st_size and previous_entry.get("mtime_ns") == stat.st_mtime_ns:
+        content_hash = previous_entry["hash"]
+    else:
+        content_hash = hash_file(file.path)
+    shard_name = f"{file.path.stem}_{content_hash[:16]}"
+    if head:
+        shard_name += f"_head{head}"
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "hash": content_hash,
+        "head": head,
+        "shard": f"{shard_name}.parquet",
+    }
+
+
+def is_cached(file: File, entry: dict, manifest: dict[str, dict]) -> bool:
+    previous_entry = manifest.get(str(file.path.resolve()))
+    return previous_entry is not None and previous_entry["shard"] == entry["shard"] and get_shard_path(entry).exists()
+
+
+def update_manifest(manifest: dict[str, dict], file: File, entry: dict) -> None:
+    key = str(file.path.resolve())
+    previous_entry = manifest.get(key)
+    if previous_entry is not None and previous_entry["shard"] != entry["shard"]:
+        logger.debug(f"Removing stale shard: {previous_entry['shard']}")
+        get_shard_path(previous_entry).unlink(missing_ok=True)
+    manifest[key] = entry
@@ -0,0 +1,173 @@
+import argparse
+from collections import Counter
+from functools import lru_cache
+from itertools import combinations_with_replacement
+from pathlib import Path
+
+import numpy
+
+from logger import logger
+from src.models.Card import RANK_COUNT, Rank, Suit
+
+# Perfect hash weights: the weighted sum of the ranks of a five card hand is unique for every rank multiset
+RANK_WEIGHTS = [0, 1, 5, 22, 94, 312, 992, 2422, 5624, 12522, 19998, 43258, 79415]
+HAND_SIZE = 5
+
+# Layout of a packed hand record: one bit per flag, then four bits per rank where 0 means "no rank"
+HAND_FLAGS = [
+    "is_flush",
+    "is_straight",
+    "is_straight_flush",
+    "is_pair",
+    "is_two_pair",
+    "is_trips",
+    "is_quads",
+    "is_full_house",
+]
+HAND_RANKS = [
+    "best_hand_value",
+    "pair_rank",
+    "full_house_pair_rank",
+    "straight_rank",
+    "set_rank",
+    "quads_rank",
+]
+HAND_RANK_BITS = 4
+HAND_RANK_MASK = (1 << HAND_RANK_BITS) - 1
+
+# Built by running this module, see get_compact_hand_table
+HAND_TABLE_PATH = Path(__file__).parent / "data" / "hand_table.npy"
+HAND_TABLE_SIZE = (HAND_SIZE * RANK_WEIGHTS[-1] + 1) * 2
+
+
+def get_hand_rank_offset(field: str) -> int:
+    return len(HAND_FLAGS) + HAND_RANKS.index(field) * HAND_RANK_BITS
+
+
+def evaluate_hand(ranks: tuple[int, ...], is_flush: bool) -> dict[str, bool | int | None]:
+    counts = Counter(ranks)
+    trips = [rank for rank, count in counts.items() if count == 3]
+    pairs = sorted((rank for rank, count in counts.items() if count == 2), reverse=True)
+    quads = [rank for rank, count in counts.items() if count == 4]
+    is_straight = len(counts) == HAND_SIZE and max(ranks) - min(ranks) == HAND_SIZE - 1
+    is_full_house = bool(trips) and bool(pairs)
+
+    if is_straight and is_flush:
+        best_hand_value = 1
+    elif quads:
+        best_hand_value = 2
+    elif is_full_house:
+        best_hand_value = 3
+    elif is_flush:
+        best_hand_value = 4
+    elif is_straight:
+        best_hand_value = 5
+    elif trips:
+        best_hand_value = 6
+    elif len(pairs) == 2:
+        best_hand_value = 7
+    elif pairs:
+        best_hand_value = 8
+    else:
+        best_hand_value = 9
+
+    return {
+        "is_flush": is_flush,
+        "is_straight": is_straight,
+        "is_straight_flush": is_straight and is_flush,
+        "is_pair": bool(pairs) and not trips,
+        "is_two_pair": len(pairs) == 2,
+        "is_trips": bool(trips),
+        "is_quads": bool(quads),
+        "is_full_house": is_full_house,
+        "best_hand_value": best_hand_value,
+        "pair_rank": pairs[0] if pairs and not trips else None,
+        "full_house_pair_rank": pairs[0] if is_full_house else None,
+        "straight_rank": max(ranks) if is_straight else None,
+        "set_rank": trips[0] if trips else None,
+        "quads_rank": quads[0] if quads else None,
+    }
+
+
+def pack_hand(hand: dict[str, bool | int | None]) -> int:
+    record = 0
+    for index, flag in enumerate(HAND_FLAGS):
+        record |= int(hand[flag]) << index
+    for field in HAND_RANKS:
+        record |= (hand[field] or 0) << get_hand_rank_offset(field)
+    return record
+
+
+@lru_cache(maxsize=None)
+def get_rank_key_table() -> numpy.ndarray:
+    """
+    Maps a 13-bit rank mask to the sum of the weights of its ranks.
+    Adding up the entries of the four suit masks of a hand gives its rank key.
+    """
+    rank_masks = numpy.arange(1 << RANK_COUNT)
+    rank_keys = numpy.zeros(1 << RANK_COUNT, dtype=numpy.uint32)
+    for index, weight in enumerate(RANK_WEIGHTS):
+        rank_keys += ((rank_masks >> index) & 1).astype(numpy.uint32) * weight
+    return rank_keys
+
+
+def build_hand_table() -> numpy.ndarray:
+    """
+    Packed hand records indexed by rank key * 2 + is_flush.
+    """
+    hand_table = numpy.zeros(HAND_TABLE_SIZE, dtype=numpy.uint32)
+    for indices in combinations_with_replacement(range(RANK_COUNT), HAND_SIZE):
+        if max(Counter(indices).values()) > len(Suit):
+            continue
+        ranks = tuple(index + Rank.TWO.value for index in indices)
+        rank_key = sum(RANK_WEIGHTS[index] for index in indices)
+        hand_table[rank_key * 2] = pack_hand(evaluate_hand(ranks=ranks, is_flush=False))
+        if len(set(indices)) == HAND_SIZE:
+            hand_table[rank_key * 2 + 1] = pack_hand(evaluate_hand(ranks=ranks, is_flush=True))
+    return hand_table
+
+
+def get_compact_hand_table(hand_table: numpy.ndarray) -> numpy.ndarray:
+    """
+    The entries of the hand table that hold a hand, as a row of their indices over a row of their records.
+    Only one entry in a hundred holds a hand, every valid hand packs to a record that is not zero.
+    """
+    indices = numpy.flatnonzero(hand_table).astype(numpy.uint32)
+    return numpy.stack([indices, hand_table[indices]])
+
+
+@lru_cache(maxsize=None)
+def get_hand_table() -> numpy.ndarray:
+    """
+    The hand table, spread out from the compact one shipped in HAND_TABLE_PATH so hands are looked up by index,
+    or built when the file is missing or malformed. The compact table is read whole, it is only 60 KB.
+    """
+    if HAND_TABLE_PATH.exists():
+        compact_hand_table = numpy.load(HAND_TABLE_PATH)
+        if (
+            compact_hand_table.ndim == 2 and compact_hand_table.shape[0] == 2
+            and compact_hand_table.dtype == numpy.uint32
+            and (compact_hand_table[0] < HAND_TABLE_SIZE).all()
+        ):
+            indices, records = compact_hand_table
+            hand_table = numpy.zeros(HAND_TABLE_SIZE, dtype=numpy.uint32)
+            hand_table[indices] = records
+            return hand_table
+        logger.warning(f"Ignoring malformed hand table: {HAND_TABLE_PATH}")
+    return build_hand_table()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the hand table shipped with the analyzer.")
+    parser.add_argument("--check", action="store_true", help="Only verify that the shipped hand table is up to date.")
+    args = parser.parse_args()
+
+    compact_hand_table = get_compact_hand_table(build_hand_table())
+    if args.check:
+        if not HAND_TABLE_PATH.exists() or not numpy.array_equal(numpy.load(HAND_TABLE_PATH), compact_hand_table):
+            raise SystemExit(f"{HAND_TABLE_PATH} is out of date, rebuild it with: python -m src.hand_evaluator")
+        logger.info(f"{HAND_TABLE_PATH} is up to date")
+    else:
+        HAND_TABLE_PATH.parent.mkdir(exist_ok=True)
+        numpy.save(HAND_TABLE_PATH, compact_hand_table)
+        logger.info(f"Wrote {HAND_TABLE_PATH}")
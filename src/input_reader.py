@@ -1,12 +1,48 @@
+import operator
 import os
 import time
-from functools import lru_cache
+from functools import lru_cache, reduce
+from itertools import combinations
+from pathlib import Path
 
+import numpy
 import polars
 
 from logger import logger
 from src.settings import SETTINGS
+from src.dataset import scan_dataset
+from src.export_parser import parse_export
+from src.file_cache import (
+    get_cache_entry,
+    get_shard_folder,
+    get_shard_path,
+    is_cached,
+    load_manifest,
+    save_manifest,
+    update_manifest,
+)
+from src.hand_evaluator import (
+    HAND_FLAGS,
+    HAND_RANK_MASK,
+    HAND_SIZE,
+    get_hand_rank_offset,
+    get_hand_table,
+    get_rank_key_table,
+)
+from src.models.Action import Action
+from src.models.Card import (
+    ALL_RANKS_MASK,
+    CARD_IDS,
+    CARD_NAMES,
+    HOLE_CARD_COUNT,
+    RANK_COUNT,
+    RANK_COUNT_BITS,
+    RANK_ORDER,
+    Rank,
+    Suit,
+)
 from src.models.File import File
+from src.output_writer import write_outputs
 
 
 def mark_as_processed(
@@ -22,65 +58,130 @@ def mark_as_processed(
     os.rename(src=f"{folder_name}/{file_name}", dst=destination_file)
 
 
-RANK_ORDER = "23456789TJQKA"  # For sorting ranks
-REVERSED_RANK_ORDER = RANK_ORDER[::-1]  # For reversed order
-
-
-@lru_cache(maxsize=None)
-def get_rank_index(rank: str) -> int:
-    try:
-        return RANK_ORDER.index(rank)
-    except ValueError:
-        logger.error(f"Invalid rank: {rank}")
-        raise ValueError(f"Invalid rank: {rank}. Valid ranks are: {RANK_ORDER}")
+# Cards are carried as UInt8 ids and hands as UInt64 masks of those ids, see src.models.Card
+HOLE_COMBO_INDICES = list(combinations(range(4), 2))  # Omaha plays exactly two of the four hole cards
+FLUSH_DRAW_SUIT_ORDER = [Suit.SPADES, Suit.HEARTS, Suit.DIAMONDS, Suit.CLUBS]
+RANK_COLUMNS_MULTIPLIER = sum(1 << (index * RANK_COUNT) for index in range(len(Suit)))  # Copies a rank mask to every suit
+HAND_RANK_DTYPES = {
+    "best_hand_value": polars.UInt8,
+    "pair_rank": polars.UInt8,
+    "full_house_pair_rank": polars.UInt8,
+    "straight_rank": polars.UInt8,
+    "set_rank": polars.UInt8,
+    "quads_rank": polars.UInt8,
+}
+BEST_HAND_LABELS = {
+    1: "Straight Flush",
+    2: "Four of a Kind",
+    3: "Full House",
+    4: "Flush",
+    5: "Straight",
+    6: "Three of a Kind",
+    7: "Two Pair",
+    8: "One Pair",
+    9: "High Card",
+}
+FLUSH_DRAW_LABELS = {
+    1: "Nut Flush Draw",
+    2: "2nd Nut Flush Draw",
+    3: "3rd Nut Flush Draw",
+    4: "Low Flush Draw",
+    9: "No Flush Draw",
+}
+# Enums list every value up front, so files share one encoding and compare in order of strength
+ACTION_DTYPE = polars.Enum([action.value for action in Action])
+BEST_HAND_DTYPE = polars.Enum(list(BEST_HAND_LABELS.values()))
+FLUSH_DRAW_DTYPE = polars.Enum(list(FLUSH_DRAW_LABELS.values()))
+HOLE_CARDS_DTYPE = polars.Array(polars.UInt8, HOLE_CARD_COUNT)
+
+
+def _card_bit(card_id: polars.Expr) -> polars.Expr:
+    return polars.lit(2, dtype=polars.UInt64).pow(card_id)
+
+
+def _cards_mask(cards: polars.Expr) -> polars.Expr:
+    # Card ids are unique within a hand, so adding their bits is the same as OR-ing them
+    return cards.list.eval(_card_bit(polars.element())).list.sum().cast(polars.UInt64)
+
+
+def _suit_rank_mask(hand_mask: polars.Expr, suit: Suit) -> polars.Expr:
+    suit_offset = 1 << (list(Suit).index(suit) * RANK_COUNT)
+    return (
+        (hand_mask // polars.lit(suit_offset, dtype=polars.UInt64)) & polars.lit(ALL_RANKS_MASK, dtype=polars.UInt64)
+    ).cast(polars.UInt16)
+
+
+def _rank_mask(hand_mask: polars.Expr) -> polars.Expr:
+    rank_mask = polars.lit(0, dtype=polars.UInt16)
+    for suit in Suit:
+        rank_mask = rank_mask | _suit_rank_mask(hand_mask=hand_mask, suit=suit)
+    return rank_mask
+
+
+def _unpack_hand_rank(hand_record: polars.Expr, field: str) -> polars.Expr:
+    return (hand_record // (1 << get_hand_rank_offset(field))) & HAND_RANK_MASK
+
+
+def _highest_rank(rank_mask: polars.Expr) -> polars.Expr:
+    # Rank masks are UInt16, so the highest rank sits 16 - leading zeros bits up, and rank values start at 2
+    return (17 - rank_mask.bitwise_leading_zeros()).cast(polars.UInt8)
+
+
+def split_export_lines(dataframe: polars.DataFrame | polars.LazyFrame) -> polars.DataFrame | polars.LazyFrame:
+    return (
+        dataframe.with_columns(
+            polars.col("column_1")
+            .str.split_exact(":", 1)
+            .struct.rename_fields(["weight", "hole_cards"])
+            .struct.unnest()
+        )
+        .with_columns(polars.col("weight").cast(polars.Float32, strict=False))
+        .drop("column_1")
+        .with_columns(
+            polars.col("hole_cards")
+            .str.extract_all(r"([2-9TJQKA][hdcs])")
+            .list.eval(polars.element().replace_strict(CARD_IDS, return_dtype=polars.UInt8))
+            .alias("hole_cards")
+        )
+    )
 
 
 def read_file(file: File, lazy: bool = False, head: int = None) -> polars.DataFrame | polars.LazyFrame:
     logger.debug(f"Reading file: {file}")
     start = time.time()
-    dataframe = polars.read_csv(file.path, has_header=False)
-    if lazy:
-        dataframe = dataframe.lazy()
+    dataframe = parse_export(path=file.path, head=head) if SETTINGS.FAST_EXPORT_PARSER else None
+    if dataframe is not None:
+        if lazy:
+            dataframe = dataframe.lazy()
+    else:
+        if lazy:
+            dataframe = polars.scan_csv(file.path, has_header=False)
+        else:
+            dataframe = polars.read_csv(file.path, has_header=False)
+        if head:
+            dataframe = dataframe.head(head)
+        logger.debug("Splitting data into weight and hole cards")
+        dataframe = split_export_lines(dataframe)
     logger.debug(f"Done in {time.time() - start:.2f} seconds")
 
-    if head:
-        dataframe = dataframe.head(head)
-
     logger.debug("Generating index column")
     start = time.time()
-    dataframe = dataframe.with_columns(
-        polars.arange(0, polars.count(), dtype=polars.UInt32)
-        .alias("row_idx")
-    )
+    dataframe = dataframe.with_row_index("row_idx")
     logger.debug(f"Done in {time.time() - start:.2f} seconds")
 
     logger.debug("Adding action column")
     start = time.time()
     dataframe = dataframe.with_columns(
         polars.lit(file.action)
-        .cast(polars.Categorical)
+        .cast(ACTION_DTYPE)
         .alias("action")
     )
     logger.debug(f"Done in {time.time() - start:.2f} seconds")
 
-    logger.debug("Splitting data into weight and hole card. Adding community cards and community card combos")
+    logger.debug("Adding community cards")
     start = time.time()
-    dataframe = (
-        dataframe.with_columns(
-            polars.col("column_1")
-            .str.split_exact(":", 1)
-            .struct.rename_fields(["weight", "hole_cards"])
-            .struct.unnest()
-        )
-        .with_columns(polars.col("weight").cast(polars.Float32, strict=False))
-        .drop("column_1")
-        .with_columns(
-            polars.col("hole_cards")
-            .str.extract_all(r"([2-9TJQKA][hdcs])")
-            .alias("hole_cards")
-        )
-        .with_columns(polars.lit(file.cards).alias("community_cards"))
-        .with_columns(polars.lit(file.combos).alias("community_combos"))
+    dataframe = dataframe.with_columns(
+        polars.lit(file.card_ids, dtype=polars.List(polars.UInt8)).alias("community_cards")
     )
     logger.debug(f"Done in {time.time() - start:.2f} seconds")
 
@@ -88,32 +189,37 @@ def read_file(file: File, lazy: bool = False, head: int = None) -> polars.DataFr
     start = time.time()
     dataframe = dataframe.with_columns(
         polars.col("hole_cards")
-        .list.join("")
-        .str.extract_all(r"([2-9TJQKA])")
+        .list.eval(
+            (polars.element() % RANK_COUNT).replace_strict(dict(enumerate(RANK_ORDER)), return_dtype=polars.String)
+        )
         .list.sort(descending=True)
         .list.join("")
-        .alias("hole_cards_ranks")
+        .alias("hole_cards_ranks"),
+        # Encoded forms of the hole cards, so KPIs can match ranks and cards with integer mask tests
+        polars.col("hole_cards")
+        .list.eval(polars.lit(2, dtype=polars.UInt64).pow(polars.element() % RANK_COUNT * RANK_COUNT_BITS))
+        .list.sum()
+        .cast(polars.UInt64)
+        .alias("hole_cards_rank_counts"),
+        _cards_mask(polars.col("hole_cards")).alias("hole_cards_mask"),
     )
     logger.debug(f"Done in {time.time() - start:.2f} seconds")
 
-    logger.debug("Generate community card combinations")
+    return dataframe
+
+
+def _hole_combo(first: int, second: int) -> polars.Expr:
+    return _card_bit(polars.col("hole_cards").list.get(first)) | _card_bit(polars.col("hole_cards").list.get(second))
+
+
+def explode_combinations(dataframe: polars.DataFrame | polars.LazyFrame, file: File) -> polars.DataFrame | polars.LazyFrame:
+    logger.debug("Generate hole and community card combinations")
     start = time.time()
-    hole_combos = (
-        dataframe.select(["hole_cards"])
-        .with_columns(polars.arange(0, polars.len()).alias("row_idx"))
-        .explode("hole_cards")
-        .rename({"hole_cards": "card_1"})
-        .join(
-            dataframe.explode("hole_cards").rename({"hole_cards": "card_2"}),
-            on="row_idx",
-        )
-        .filter(polars.col("card_1") < polars.col("card_2"))
-        .group_by("row_idx")
-        .agg(
-            polars.concat_list(["card_1", "card_2"]).alias("hole_combos")
-        )
+    dataframe = dataframe.with_columns(
+        polars.concat_list(_hole_combo(first=first, second=second) for first, second in HOLE_COMBO_INDICES)
+        .alias("hole_combos"),
+        polars.lit(file.combo_masks, dtype=polars.List(polars.UInt64)).alias("community_combos"),
     )
-    dataframe = dataframe.join(hole_combos, on="row_idx")
     logger.debug(f"Done in {time.time() - start:.2f} seconds")
 
     logger.debug("Exploding hole and community card combinations")
@@ -125,26 +231,10 @@ def read_file(file: File, lazy: bool = False, head: int = None) -> polars.DataFr
     )
     logger.debug(f"Done in {time.time() - start:.2f} seconds")
 
-    logger.debug("Creating hole hand ranks")
-    start = time.time()
-    dataframe = dataframe.with_columns(
-        polars.col("hole_hand")
-        .list.join("")
-        .str.extract_all(r"([2-9TJQKA])")
-        .list.eval(
-            polars.element().replace({"T": 10, "J": 11, "Q": 12, "K": 13, "A": 14})
-        )
-        .cast(polars.List(polars.UInt8))
-        .alias("hole_hand_ranks")
-    )
-    logger.debug(f"Done in {time.time() - start:.2f} seconds")
-
     logger.debug("Creating hand")
     start = time.time()
     dataframe = dataframe.with_columns(
-        polars.concat_list(["hole_hand", "community_hand"])
-        .list.sort()
-        .list.join("")
+        (polars.col("hole_hand") | polars.col("community_hand"))
         .alias("hand")
     )
     logger.debug(f"Done in {time.time() - start:.2f} seconds")
@@ -152,66 +242,105 @@ def read_file(file: File, lazy: bool = False, head: int = None) -> polars.DataFr
     return dataframe
 
 
-def apply_poker_hands(
-    poker_hands: polars.DataFrame, dataframe: polars.DataFrame
-) -> polars.DataFrame:
-    dataframe = dataframe.join(
-        poker_hands,
-        left_on="hand",
-        right_on="hand",
-        how="left",
+def _hand_record(suit_masks: dict[Suit, polars.Expr]) -> polars.Expr:
+    rank_key = polars.sum_horizontal(
+        polars.lit(polars.Series(get_rank_key_table())).gather(suit_mask) for suit_mask in suit_masks.values()
     )
+    is_flush = polars.any_horizontal(suit_mask.bitwise_count_ones() == HAND_SIZE for suit_mask in suit_masks.values())
+    return polars.lit(polars.Series(get_hand_table())).gather(rank_key * 2 + is_flush.cast(polars.UInt32))
 
-    return dataframe
 
+def apply_poker_hands(dataframe: polars.DataFrame | polars.LazyFrame) -> polars.DataFrame | polars.LazyFrame:
+    logger.debug("Evaluating poker hands")
+    start = time.time()
+    dataframe = dataframe.with_columns(
+        _hand_record({suit: _suit_rank_mask(hand_mask=polars.col("hand"), suit=suit) for suit in Suit})
+        .alias("hand_record")
+    )
 
-def calculate_flush_draws(dataframe: polars.DataFrame) -> polars.DataFrame:
-    def flush_level(hand: list[str], board: list[str]) -> int:
-        suits = ["s", "h", "d", "c"]
+    hand_record = polars.col("hand_record")
+    dataframe = dataframe.with_columns(
+        [((hand_record & (1 << index)) != 0).alias(flag) for index, flag in enumerate(HAND_FLAGS)]
+        + [
+            polars.when(_unpack_hand_rank(hand_record=hand_record, field=field) > 0)
+            .then(_unpack_hand_rank(hand_record=hand_record, field=field))
+            .cast(dtype)
+            .alias(field)
+            for field, dtype in HAND_RANK_DTYPES.items()
+        ]
+    ).drop("hand_record")
+    logger.debug(f"Done in {time.time() - start:.2f} seconds")
+
+    return dataframe
 
-        for suit in suits:
-            hand_suit_cards = [card for card in hand if card.endswith(suit)]
-            hand_ranks = set(card[0] for card in hand_suit_cards)
-            board_suit_cards = [card for card in board if card.endswith(suit)]
-            board_ranks = set(card[0] for card in board_suit_cards)
 
-            if len(hand_suit_cards) >= 2 and len(board_suit_cards) >= 2:
-                known_ranks = set(card[0] for card in hand_suit_cards + board_suit_cards)
+def _nut_flush_ranks(board_mask: polars.Expr) -> list[polars.Expr]:
+    # Same as src.models.Board.get_nut_flush_ranks, for a board that changes from row to row
+    missing_ranks = ~board_mask & polars.lit(ALL_RANKS_MASK, dtype=polars.UInt16)
+    nut_rank = polars.lit(1 << 15, dtype=polars.UInt16) // polars.lit(2, dtype=polars.UInt16).pow(
+        missing_ranks.bitwise_leading_zeros()
+    )
+    second_nut_rank = nut_rank // 2
+    third_nut_rank = polars.when((board_mask & second_nut_rank) == 0).then(nut_rank // 4).otherwise(0)
+    return [nut_rank, second_nut_rank, third_nut_rank]
+
+
+def _flush_level(hand_mask: polars.Expr, nut_flush_ranks: list[polars.Expr | int]) -> polars.Expr:
+    nut_rank, second_nut_rank, third_nut_rank = nut_flush_ranks
+    return (
+        polars.when((hand_mask & nut_rank) != 0)
+        .then(1)  # Nut flush draw
+        .when((hand_mask & second_nut_rank) != 0)
+        .then(2)  # 2nd Nut flush draw
+        .when((hand_mask & third_nut_rank) != 0)
+        .then(3)  # 3rd Nut flush draw
+        .otherwise(4)  # Low flush draw
+    )
 
-                highest_board_rank_index = 0
-                while True:
-                    highest_possible_rank = REVERSED_RANK_ORDER[highest_board_rank_index]
-                    if highest_possible_rank in board_ranks:
-                        highest_board_rank_index += 1
-                    else:
-                        break
 
-                if REVERSED_RANK_ORDER[highest_board_rank_index] in hand_ranks:
-                    return 1  # Nut flush draw
-                elif REVERSED_RANK_ORDER[highest_board_rank_index+1] in hand_ranks and REVERSED_RANK_ORDER[highest_board_rank_index] not in known_ranks:
-                    return 2  # 2nd Nut flush draw
-                elif REVERSED_RANK_ORDER[highest_board_rank_index+2] in hand_ranks and all(x not in known_ranks for x in [REVERSED_RANK_ORDER[highest_board_rank_index], REVERSED_RANK_ORDER[highest_board_rank_index+1]]):
-                    return 3  # 3rd Nut flush draw
-                else:
-                    return 4  # Low flush draw
+def _flush_draw(
+    hole_suit_masks: dict[Suit, polars.Expr],
+    board_has_draw: dict[Suit, polars.Expr | bool],
+    nut_flush_ranks: dict[Suit, list[polars.Expr | int]],
+) -> polars.Expr:
+    flush_draw = polars
+    for suit in FLUSH_DRAW_SUIT_ORDER:
+        # Boards known up front skip the suits they have no flush draw in
+        if board_has_draw[suit] is False:
+            continue
+        has_draw = hole_suit_masks[suit].bitwise_count_ones() >= 2
+        if board_has_draw[suit] is not True:
+            has_draw = has_draw & board_has_draw[suit]
+        flush_draw = flush_draw.when(has_draw).then(
+            _flush_level(hand_mask=hole_suit_masks[suit], nut_flush_ranks=nut_flush_ranks[suit])
+        )
+    if flush_draw is polars:
+        return polars.lit(9, dtype=polars.UInt8)
+    return flush_draw.otherwise(9).cast(polars.UInt8)  # 9 = No flush draw
 
-        return 9  # No flush draw
 
+def calculate_flush_draws(dataframe: polars.DataFrame | polars.LazyFrame) -> polars.DataFrame | polars.LazyFrame:
     logger.debug("Calculating flush draws")
     start = time.time()
     dataframe = dataframe.with_columns(
-        polars.struct(["hole_hand", "community_hand"]).map_elements(
-            lambda row: flush_level(row["hole_hand"], row["community_hand"]),
-            return_dtype=polars.UInt8
-        ).alias("flush_draw")
+        _suit_rank_mask(hand_mask=polars.col(column), suit=suit).alias(f"{column}_{suit}_mask")
+        for column in ["hole_hand", "community_hand"]
+        for suit in Suit
     )
+    dataframe = dataframe.with_columns(
+        _flush_draw(
+            hole_suit_masks={suit: polars.col(f"hole_hand_{suit}_mask") for suit in Suit},
+            board_has_draw={suit: polars.col(f"community_hand_{suit}_mask").bitwise_count_ones() >= 2 for suit in Suit},
+            nut_flush_ranks={suit: _nut_flush_ranks(polars.col(f"community_hand_{suit}_mask")) for suit in Suit},
+        ).alias("flush_draw")
+    ).drop([f"{column}_{suit}_mask" for column in ["hole_hand", "community_hand"] for suit in Suit])
     logger.debug(f"Done in {time.time() - start:.2f} seconds")
 
     logger.debug("Calculating flush ranks")
     start = time.time()
     dataframe = dataframe.with_columns(
         polars.when(polars.col("is_flush"))
-        .then(polars.col("hole_hand_ranks").list.max())
+        .then(_highest_rank(_rank_mask(polars.col("hole_hand"))))
         .otherwise(None)
         .alias("flush_rank")
     )
@@ -220,17 +349,11 @@ def calculate_flush_draws(dataframe: polars.DataFrame) -> polars.DataFrame:
     return dataframe
 
 
-def _get_straight_draw_ranks(is_straight: bool, hole_hand: list[str], community_hand: list[str]) -> list[str]:
-    if is_straight:
-        return []
-
-    hole_indices = {get_rank_index(card[0]) for card in hole_hand}
+def _get_straight_draw_mask(hole_indices: set[int], community_indices: set[int]) -> int:
     if len(hole_indices) < 2 or max(hole_indices) - min(hole_indices) > 4:
-        return []
-
-    community_indices = {get_rank_index(card[0]) for card in community_hand}
-    outs = set()
+        return 0
 
+    outs = 0
     for index in community_indices:
         other_indices = community_indices.copy()
         if len(other_indices) == 1:
@@ -241,30 +364,64 @@ def _get_straight_draw_ranks(is_straight: bool, hole_hand: list[str], community_
         for replacement in range(0, 13):
             new_indices = indices.union({replacement})
             if len(new_indices) == 5 and max(new_indices) - min(new_indices) == 4:
-                outs.add(RANK_ORDER[replacement])
+                outs |= 1 << replacement
 
-    return sorted(outs, key=get_rank_index)
+    return outs
 
 
-def calculate_straight_draw_ranks(dataframe: polars.DataFrame) -> polars.DataFrame:
+@lru_cache(maxsize=None)
+def get_straight_draw_table() -> polars.DataFrame:
+    """
+    Tabulates the straight draw outs of every (hole rank mask, community rank mask) pair.
+    Pairs without outs are left out, so the table must be applied with a left join.
+    """
+    rows = {"hole_rank_mask": [], "community_rank_mask": [], "draw_straight_mask": []}
+    for hole_indices in combinations(range(len(RANK_ORDER)), 2):
+        for community_size in range(1, 4):
+            for community_indices in combinations(range(len(RANK_ORDER)), community_size):
+                draw_straight_mask = _get_straight_draw_mask(set(hole_indices), set(community_indices))
+                if not draw_straight_mask:
+                    continue
+                rows["hole_rank_mask"].append(sum(1 << index for index in hole_indices))
+                rows["community_rank_mask"].append(sum(1 << index for index in community_indices))
+                rows["draw_straight_mask"].append(draw_straight_mask)
+    return polars.DataFrame(
+        rows,
+        schema={
+            "hole_rank_mask": polars.UInt16,
+            "community_rank_mask": polars.UInt16,
+            "draw_straight_mask": polars.UInt16,
+        },
+    )
+
+
+def calculate_straight_draw_ranks(dataframe: polars.DataFrame | polars.LazyFrame) -> polars.DataFrame | polars.LazyFrame:
     logger.debug("Calculating straight draw ranks")
     start = time.time()
-    dataframe = dataframe.with_columns(
-        polars.struct(["is_straight", "hole_hand", "community_hand"]).map_elements(
-            lambda row: _get_straight_draw_ranks(
-                is_straight=row["is_straight"],
-                hole_hand=row["hole_hand"],
-                community_hand=row["community_hand"],
-            ),
-            return_dtype=polars.List(polars.Utf8)
-        ).alias("draw_straight_ranks")
+    straight_draw_table = get_straight_draw_table()
+    if isinstance(dataframe, polars.LazyFrame):
+        straight_draw_table = straight_draw_table.lazy()
+    dataframe = (
+        dataframe.with_columns(
+            _rank_mask(polars.col("hole_hand")).alias("hole_rank_mask"),
+            _rank_mask(polars.col("community_hand")).alias("community_rank_mask"),
+        )
+        .join(straight_draw_table, on=["hole_rank_mask", "community_rank_mask"], how="left")
+        .with_columns(
+            polars.when(polars.col("is_straight"))
+            .then(0)
+            .otherwise(polars.col("draw_straight_mask").fill_null(0))
+            .cast(polars.UInt16)
+            .alias("draw_straight_mask")
+        )
+        .drop(["hole_rank_mask", "community_rank_mask"])
     )
     logger.debug(f"Done in {time.time() - start:.2f} seconds")
 
     return dataframe
 
 
-def collapse_on_index(dataframe: polars.DataFrame) -> polars.DataFrame:
+def collapse_on_index(dataframe: polars.DataFrame | polars.LazyFrame) -> polars.DataFrame | polars.LazyFrame:
     logger.debug("Collapsing dataframe on row index")
     dataframe = dataframe.group_by("row_idx").agg(
         polars.col("action").first(),
@@ -272,6 +429,8 @@ def collapse_on_index(dataframe: polars.DataFrame) -> polars.DataFrame:
         polars.col("community_cards").first(),
         polars.col("hole_cards").first(),
         polars.col("hole_cards_ranks").first(),
+        polars.col("hole_cards_rank_counts").first(),
+        polars.col("hole_cards_mask").first(),
         polars.col("is_flush").any(),
         polars.col("is_straight").any(),
         polars.col("is_straight_flush").any(),
@@ -280,103 +439,197 @@ def collapse_on_index(dataframe: polars.DataFrame) -> polars.DataFrame:
         polars.col("is_trips").any(),
         polars.col("is_quads").any(),
         polars.col("is_full_house").any(),
-        polars.col("pair_rank").flatten(),
+        polars.col("pair_rank").max(),
         polars.col("full_house_pair_rank").filter(polars.col("is_full_house")).unique().reverse(),
         polars.col("flush_rank").max(),
         polars.col("straight_rank").filter(polars.col("is_straight")).max(),
         polars.col("set_rank").filter(polars.col("is_trips")).unique().reverse(),
         polars.col("best_hand_value").min(),
         polars.col("flush_draw").min(),
-        polars.col("draw_straight_ranks").list.unique().alias("draw_straight_ranks"),
+        polars.col("draw_straight_mask").bitwise_or(),
     )
 
+    dataframe = dataframe.drop("row_idx")
+    return dataframe
+
+
+def label_hands(dataframe: polars.DataFrame | polars.LazyFrame) -> polars.DataFrame | polars.LazyFrame:
     dataframe = dataframe.with_columns(
-        polars.col("pair_rank")
-        .list.max()
+        polars.col("best_hand_value").replace_strict(BEST_HAND_LABELS, return_dtype=BEST_HAND_DTYPE).alias("best_hand"),
+        polars.col("flush_draw").replace_strict(FLUSH_DRAW_LABELS, return_dtype=FLUSH_DRAW_DTYPE),
     )
+    return dataframe
 
+
+@lru_cache(maxsize=None)
+def get_straight_draw_lookup(community_rank_mask: int) -> polars.Series:
+    """
+    Straight draw outs by hole rank mask for a single community rank mask, so they can be gathered instead of joined.
+    """
+    straight_draw_table = get_straight_draw_table().filter(polars.col("community_rank_mask") == community_rank_mask)
+    lookup = numpy.zeros(1 << RANK_COUNT, dtype=numpy.uint16)
+    lookup[straight_draw_table["hole_rank_mask"].to_numpy()] = straight_draw_table["draw_straight_mask"].to_numpy()
+    return polars.Series(lookup)
+
+
+def _rank_or_null(rank: polars.Expr) -> polars.Expr:
+    return polars.when(rank > 0).then(rank)
+
+
+def evaluate_hands_fused(dataframe: polars.DataFrame | polars.LazyFrame, file: File) -> polars.DataFrame | polars.LazyFrame:
+    """
+    Evaluates every hole combo against every community combo as side by side columns and reduces them within the row.
+    Yields the same columns as exploding the combos and going through collapse_on_index, without the row blow-up.
+    The community cards only come in as scalars precomputed by src.models.Board, so per row work is on the hole cards.
+    """
+    logger.debug("Evaluating hole and community card combinations in place")
+    start = time.time()
     dataframe = dataframe.with_columns(
-        polars.col("best_hand_value")
-        .cast(polars.String)
-        .str.replace("1", "Straight Flush")
-        .str.replace("2", "Four of a Kind")
-        .str.replace("3", "Full House")
-        .str.replace("4", "Flush")
-        .str.replace("5", "Straight")
-        .str.replace("6", "Three of a Kind")
-        .str.replace("7", "Two Pair")
-        .str.replace("8", "One Pair")
-        .str.replace("9", "High Card")
-        .alias("best_hand")
+        [
+            _suit_rank_mask(hand_mask=_hole_combo(first=first, second=second), suit=suit)
+            .alias(f"hole_hand_{hole_index}_{suit}_mask")
+            for hole_index, (first, second) in enumerate(HOLE_COMBO_INDICES)
+            for suit in Suit
+        ]
+        + [
+            _rank_mask(_hole_combo(first=first, second=second)).alias(f"hole_rank_mask_{hole_index}")
+            for hole_index, (first, second) in enumerate(HOLE_COMBO_INDICES)
+        ]
     )
 
+    hand_records, flush_draws = [], []
+    for community_index, combo in enumerate(file.board.combos):
+        for hole_index in range(len(HOLE_COMBO_INDICES)):
+            hole_suit_masks = {suit: polars.col(f"hole_hand_{hole_index}_{suit}_mask") for suit in Suit}
+            hand_records.append(
+                _hand_record(
+                    {
+                        suit: hole_suit_masks[suit] | polars.lit(combo.suit_masks[suit], dtype=polars.UInt16)
+                        for suit in Suit
+                    }
+                ).alias(f"hand_record_{community_index}_{hole_index}")
+            )
+            flush_draws.append(
+                _flush_draw(
+                    hole_suit_masks=hole_suit_masks,
+                    board_has_draw={suit: combo.suit_counts[suit] >= 2 for suit in Suit},
+                    nut_flush_ranks=combo.nut_flush_ranks,
+                )
+            )
+    dataframe = dataframe.with_columns(hand_records + [polars.min_horizontal(flush_draws).alias("flush_draw")])
+
+    hand_records = [
+        (polars.col(f"hand_record_{community_index}_{hole_index}"), hole_index, combo)
+        for community_index, combo in enumerate(file.board.combos)
+        for hole_index in range(len(HOLE_COMBO_INDICES))
+    ]
+    is_flush_bit = 1 << HAND_FLAGS.index("is_flush")
+    is_straight_bit = 1 << HAND_FLAGS.index("is_straight")
+    hand_record_union = reduce(operator.or_, (hand_record for hand_record, _, _ in hand_records))
+    ranks = {
+        field: [_unpack_hand_rank(hand_record=hand_record, field=field) for hand_record, _, _ in hand_records]
+        for field in HAND_RANK_DTYPES
+    }
     dataframe = dataframe.with_columns(
-        polars.col("flush_draw")
-        .cast(polars.String)
-        .str.replace("1", "Nut Flush Draw")
-        .str.replace("2", "2nd Nut Flush Draw")
-        .str.replace("3", "3rd Nut Flush Draw")
-        .str.replace("4", "Low Flush Draw")
-        .str.replace("9", "No Flush Draw")
-        .alias("flush_draw")
+        [((hand_record_union & (1 << index)) != 0).alias(flag) for index, flag in enumerate(HAND_FLAGS)]
+        + [
+            _rank_or_null(polars.max_horizontal(ranks[field])).cast(HAND_RANK_DTYPES[field]).alias(field)
+            for field in ["pair_rank", "straight_rank"]
+        ]
+        + [
+            polars.concat_list(_rank_or_null(rank) for rank in ranks[field])
+            .list.drop_nulls()
+            .list.unique()
+            .list.sort(descending=True)
+            .cast(polars.List(HAND_RANK_DTYPES[field]))
+            .alias(field)
+            for field in ["full_house_pair_rank", "set_rank"]
+        ]
+        + [
+            polars.min_horizontal(ranks["best_hand_value"])
+            .cast(HAND_RANK_DTYPES["best_hand_value"])
+            .alias("best_hand_value"),
+            polars.max_horizontal(
+                polars.when((hand_record & is_flush_bit) != 0).then(
+                    _highest_rank(polars.col(f"hole_rank_mask_{hole_index}"))
+                )
+                for hand_record, hole_index, _ in hand_records
+            ).alias("flush_rank"),
+            reduce(
+                operator.or_,
+                (
+                    polars.when((hand_record & is_straight_bit) != 0)
+                    .then(0)
+                    .otherwise(
+                        polars.lit(get_straight_draw_lookup(combo.rank_mask)).gather(
+                            polars.col(f"hole_rank_mask_{hole_index}")
+                        )
+                    )
+                    .cast(polars.UInt16)
+                    for hand_record, hole_index, combo in hand_records
+                ),
+            ).alias("draw_straight_mask"),
+        ]
     )
+    dataframe = dataframe.drop(
+        [f"hole_hand_{hole_index}_{suit}_mask" for hole_index in range(len(HOLE_COMBO_INDICES)) for suit in Suit]
+        + [f"hole_rank_mask_{hole_index}" for hole_index in range(len(HOLE_COMBO_INDICES))]
+        + [hand_record.meta.output_name() for hand_record, _, _ in hand_records]
+        + ["row_idx"]
+    )
+    logger.debug(f"Done in {time.time() - start:.2f} seconds")
 
-    dataframe = dataframe.drop("row_idx")
     return dataframe
 
 
-def calculate_straight_draw_outs(dataframe: polars.DataFrame) -> polars.DataFrame:
-    def count_unique_flat_ranks(nested_lists: list[list[str]]) -> list[str]:
-        return list(set(rank for sublist in nested_lists for rank in sublist))
-
+def calculate_straight_draw_outs(dataframe: polars.DataFrame | polars.LazyFrame) -> polars.DataFrame | polars.LazyFrame:
+    logger.debug("Calculating straight draw outs")
+    start = time.time()
+    draw_straight_mask = polars.col("draw_straight_mask")
     dataframe = dataframe.with_columns(
-        polars.struct(["draw_straight_ranks"])
-        .map_elements(
-            lambda row: count_unique_flat_ranks(row["draw_straight_ranks"]),
-            return_dtype=polars.List(polars.String),
+        polars.concat_list(
+            # Ranks are numbered like the other rank columns, 2 to 14 for ace
+            polars.when((draw_straight_mask & (1 << index)) != 0).then(
+                polars.lit(index + Rank.TWO.value, dtype=polars.UInt8)
+            )
+            for index in range(RANK_COUNT)
         )
-        .alias("draw_straight_ranks")
-    )
-
-    def count_straight_outs(draw_ranks: list[str],
-                            hole_cards: list[str],
-                            community_cards: list[str]) -> int:
-        if not draw_ranks:
-            return 0
-
-        known_cards = hole_cards + community_cards
-        known_ranks = [card[0] for card in known_cards]  # Assuming format like "9♣", "T♠", etc.
-
-        total_outs = 0
-        for rank in draw_ranks:
-            used = known_ranks.count(rank)
-            remaining = max(0, 4 - used)
-            total_outs += remaining
+        .list.drop_nulls()
+        .alias("draw_straight_ranks"),
+        # Every out rank has 4 cards, minus the ones already in the hole or on the board
+        (
+            4 * draw_straight_mask.bitwise_count_ones()
+            - (
+                (_cards_mask(polars.col("hole_cards")) | _cards_mask(polars.col("community_cards")))
+                & (draw_straight_mask.cast(polars.UInt64) * polars.lit(RANK_COLUMNS_MULTIPLIER, dtype=polars.UInt64))
+            ).bitwise_count_ones()
+        )
+        .cast(polars.UInt8)
+        .alias("draw_straight_outs"),
+    ).drop("draw_straight_mask")
+    logger.debug(f"Done in {time.time() - start:.2f} seconds")
 
-        return total_outs
+    return dataframe
 
-    dataframe = dataframe.with_columns(
-        polars.struct(["draw_straight_ranks", "hole_cards", "community_cards"])
-        .map_elements(
-            lambda row: count_straight_outs(
-                draw_ranks=row["draw_straight_ranks"],
-                hole_cards=row["hole_cards"],
-                community_cards=row["community_cards"]
-            ),
-            return_dtype=polars.UInt8
-        ).alias("draw_straight_outs")
-    )
 
+def cast_cards(dataframe: polars.DataFrame | polars.LazyFrame) -> polars.DataFrame | polars.LazyFrame:
+    """
+    Every hand has four hole cards, so they are stored as a fixed size array.
+    Boards have three to five cards and files of different streets are scanned together, so they stay a list.
+    """
+    dataframe = dataframe.with_columns(polars.col("hole_cards").list.to_array(HOLE_CARD_COUNT))
     return dataframe
 
 
-def re_order_columns(dataframe: polars.DataFrame) -> polars.DataFrame:
+def re_order_columns(dataframe: polars.DataFrame | polars.LazyFrame) -> polars.DataFrame | polars.LazyFrame:
     columns_order = [
         "action",
         "weight",
         "community_cards",
         "hole_cards",
         "hole_cards_ranks",
+        "hole_cards_rank_counts",
+        "hole_cards_mask",
         "is_flush",
         "is_straight",
         "is_straight_flush",
@@ -400,57 +653,170 @@ def re_order_columns(dataframe: polars.DataFrame) -> polars.DataFrame:
     return dataframe
 
 
-def save_to_csv(dataframe: polars.DataFrame, filename: str) -> None:
-    for column in dataframe.columns:
-        schema = dataframe.schema[column]
-        logger.debug(f"Flattening column: {column} with schema: {schema}")
-        if schema == polars.List(polars.String):
-            dataframe = dataframe.with_columns(
-                polars.col(column)
-                .list.join(',')
-            )
-        elif schema == polars.List:
-            dataframe = dataframe.with_columns(
-                polars.col(column)
-                .cast(polars.List(polars.String))
-                .list.join(',')
-            )
-    dataframe.write_csv(filename)
+def process_file(file: File, head: int = None) -> polars.LazyFrame:
+    logger.info(f"Processing: {file}")
+    dataframe = read_file(file=file, lazy=True, head=head)
+    if SETTINGS.FUSED_EVALUATION:
+        dataframe = evaluate_hands_fused(dataframe=dataframe, file=file)
+    else:
+        dataframe = explode_combinations(dataframe=dataframe, file=file)
+        dataframe = apply_poker_hands(dataframe=dataframe)
+        dataframe = calculate_flush_draws(dataframe=dataframe)
+        dataframe = calculate_straight_draw_ranks(dataframe=dataframe)
+        dataframe = collapse_on_index(dataframe=dataframe)
+    dataframe = label_hands(dataframe=dataframe)
+    dataframe = calculate_straight_draw_outs(dataframe=dataframe)
+    dataframe = cast_cards(dataframe=dataframe)
+    dataframe = re_order_columns(dataframe=dataframe)
+    return dataframe
+
+
+def process_files_with_cache(files: list[File], head: int = None) -> list[polars.LazyFrame]:
+    manifest = load_manifest()
+    entries = [get_cache_entry(file=file, manifest=manifest, head=head) for file in files]
+    new_files = [
+        (file, entry) for file, entry in zip(files, entries) if not is_cached(file=file, entry=entry, manifest=manifest)
+    ]
+    logger.info(f"File cache: {len(files) - len(new_files)} cached, {len(new_files)} to process")
+
+    if new_files:
+        get_shard_folder().mkdir(parents=True, exist_ok=True)
+        # Only new or modified files go through the pipeline, all of them in one go
+        polars.collect_all(
+            process_file(file=file, head=head).sink_parquet(get_shard_path(entry), lazy=True)
+            for file, entry in new_files
+        )
+        for file, entry in new_files:
+            update_manifest(manifest=manifest, file=file, entry=entry)
+        save_manifest(manifest)
 
+    return [polars.scan_parquet(get_shard_path(entry)) for entry in entries]
 
-def read_input_files(lazy: bool = False, head: int = None) -> polars.DataFrame | None:
+
+def get_input_files() -> list[File]:
     files = []
     for filepath in SETTINGS.INPUT_FOLDER.iterdir():
         if not SETTINGS.INPUT_FILE_REGEX.match(filepath.name.casefold()):
             continue
         logger.info(f"Reading file: {filepath}")
         files.append(File(filepath))
+    return files
 
-    poker_hands = polars.read_parquet("poker_hands.parquet")
-    output = None
-    for file in files:
-        logger.info(f"Processing: {file}")
 
-        dataframe = read_file(file=file, lazy=lazy, head=head)
-        dataframe = apply_poker_hands(poker_hands=poker_hands, dataframe=dataframe)
-        dataframe = calculate_flush_draws(dataframe=dataframe)
-        dataframe = calculate_straight_draw_ranks(dataframe=dataframe)
-        dataframe = collapse_on_index(dataframe=dataframe)
-        dataframe = calculate_straight_draw_outs(dataframe=dataframe)
-        dataframe = re_order_columns(dataframe=dataframe)
+def process_files(files: list[File], head: int = None) -> list[polars.LazyFrame]:
+    if SETTINGS.USE_FILE_CACHE and files:
+        return process_files_with_cache(files=files, head=head)
+    # Every file gets its own lazy pipeline, so polars can run them side by side
+    return [process_file(file=file, head=head) for file in files]
 
-        if output is None:
-            output = dataframe
-        else:
-            output = output.vstack(dataframe)
+
+def read_input_files(lazy: bool = False, head: int = None) -> polars.DataFrame | polars.LazyFrame | None:
+    files = get_input_files()
+
+    dataframes = process_files(files=files, head=head)
+    if not dataframes:
+        output = None
+    elif lazy:
+        output = polars.concat(dataframes, parallel=True)
+    else:
+        output = polars.concat(polars.collect_all(dataframes))
 
     if output is not None:
         cards = "".join(files[0].cards)
         actions = "-".join(file.action.title() for file in files)
         filename = f"{SETTINGS.OUTPUT_FOLDER}/parsed_{SETTINGS.TIMESTAMP_LABEL}_{cards}_{actions}"
-        if SETTINGS.SAVE_CACHE:
-            output.write_parquet(f"{filename}.parquet")
-        if SETTINGS.SAVE_CACHE_COPY_AS_CSV:
-            save_to_csv(dataframe=output, filename=f"{filename}.csv")
+        if SETTINGS.SAVE_CACHE and lazy:
+            # Stream the pipeline into the cache and keep reading from it, so nothing is held in memory
+            output.sink_parquet(f"{filename}.parquet")
+            output = polars.scan_parquet(f"{filename}.parquet")
+        write_outputs(dataframe=output, filename=filename, save_parquet=SETTINGS.SAVE_CACHE and not lazy)
 
     return output
+
+
+def get_fragment_folder(file: Path) -> Path:
+    return file.with_suffix(".fragments")
+
+
+def get_parsed_files(file: Path) -> list[Path]:
+    """
+    A parsed file followed by the fragments appended to it, which together hold the data of its board,
+    or the partitions of a dataset folder.
+    """
+    if file.is_dir():
+        # A dataset folder or a partition of it
+        return sorted(file.glob("**/*.parquet"))
+    return [file, *sorted(get_fragment_folder(file).glob("*.parquet"))]
+
+
+def get_ipc_path(file: Path) -> Path:
+    return file.with_suffix(".arrow")
+
+
+def scan_parsed_part(file: Path) -> polars.LazyFrame:
+    """
+    Prefers the Arrow IPC copy of a parsed file, which is memory mapped instead of decoded,
+    so reading it costs the pages of the columns a query touches.
+    """
+    ipc_path = get_ipc_path(file)
+    if ipc_path.exists() and ipc_path.stat().st_mtime_ns >= file.stat().st_mtime_ns:
+        logger.debug(f"Memory mapping: {ipc_path}")
+        return polars.scan_ipc(ipc_path, memory_map=True)
+    return polars.scan_parquet(file)
+
+
+def scan_parsed_file(file: Path) -> polars.LazyFrame:
+    if file.is_dir():
+        return scan_dataset(file)
+    return polars.concat([scan_parsed_part(part) for part in get_parsed_files(file)])
+
+
+def append_input_files(parsed_file: Path, head: int = None) -> polars.LazyFrame | None:
+    """
+    Parses the files in the input folder and adds each one as a fragment of a parsed file of the same board.
+    The parsed file and the fragments appended before are left as they are.
+    Files of actions the parsed file already holds are skipped, since the input folder keeps the files parsed before.
+    """
+    input_files = get_input_files()
+    if not input_files:
+        return None
+
+    existing = scan_parsed_file(parsed_file).select(
+        polars.col("community_cards").first(),
+        polars.col("action").cast(polars.String).unique().implode(),
+    ).collect()
+    board = existing["community_cards"].item().to_list()
+    actions = existing["action"].item().to_list()
+    files = []
+    for file in input_files:
+        if file.card_ids != board:
+            raise ValueError(f"{file} is not of the board {''.join(CARD_NAMES[card] for card in board)} of {parsed_file}")
+        if file.action in actions:
+            logger.info(f"Skipping {file}, {parsed_file} already holds the action {file.action}")
+            continue
+        # Raise and bet files are both bets, and each action is written to a fragment of its own
+        duplicate = next((new_file for new_file in files if new_file.action == file.action), None)
+        if duplicate is not None:
+            raise ValueError(f"{file} and {duplicate} are both of the action {file.action}")
+        files.append(file)
+    if not files:
+        logger.info(f"No new actions to append to: {parsed_file}")
+        return scan_parsed_file(parsed_file)
+
+    fragment_folder = get_fragment_folder(parsed_file)
+    fragment_folder.mkdir(exist_ok=True)
+    fragment_paths = [fragment_folder / f"{file.action}.parquet" for file in files]
+    logger.info(f"Appending {len(files)} files to: {parsed_file}")
+    dataframes = process_files(files=files, head=head)
+    polars.collect_all(
+        dataframe.sink_parquet(fragment_path, lazy=True)
+        for dataframe, fragment_path in zip(dataframes, fragment_paths)
+    )
+    for fragment_path in fragment_paths:
+        write_outputs(
+            dataframe=polars.scan_parquet(fragment_path),
+            filename=f"{fragment_path.with_suffix('')}",
+            save_parquet=False,
+        )
+
+    return scan_parsed_file(parsed_file)
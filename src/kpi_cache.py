@@ -0,0 +1,78 @@
+import hashlib
+import json
+import time
+from pathlib import Path
+
+from logger import logger
+from src.file_cache import hash_file
+from src.models.KPI import KPI
+from src.settings import SETTINGS
+
+# Bump whenever the result of a KPI requirement changes, so results computed by older code are not reused
+KPI_ENGINE_VERSION = 3
+
+
+def get_kpi_cache_path() -> Path:
+    return SETTINGS.OUTPUT_FOLDER / "kpi_cache.json"
+
+
+def get_kpi_cache_keys(fingerprint: str, kpis: list[KPI]) -> list[str]:
+    """
+    With first-match, the result of a KPI depends on its own requirements and on those of every KPI before it.
+    Each key hashes that chain, display names aside, together with the fingerprint of the data and KPI_ENGINE_VERSION.
+    """
+    keys = []
+    prefix_hash = hashlib.sha256(f"{KPI_ENGINE_VERSION}:{fingerprint}".encode())
+    for kpi in kpis:
+        requirements = [[requirement.column, requirement.operation, requirement.value] for requirement in kpi.requirements]
+        prefix_hash.update(json.dumps(requirements).encode())
+        keys.append(f"{fingerprint}:{prefix_hash.copy().hexdigest()}")
+    return keys
+
+
+def load_kpi_cache() -> dict[str, dict]:
+    kpi_cache_path = get_kpi_cache_path()
+    if not kpi_cache_path.exists():
+        return {}
+    return json.loads(kpi_cache_path.read_text())
+
+
+def save_kpi_cache(kpi_cache: dict[str, dict]) -> None:
+    """
+    Keeps the KPI_CACHE_SIZE most recently used entries.
+    """
+    if len(kpi_cache) > SETTINGS.KPI_CACHE_SIZE:
+        logger.debug(f"Evicting {len(kpi_cache) - SETTINGS.KPI_CACHE_SIZE} KPI cache entries")
+        kept_keys = sorted(kpi_cache, key=lambda key: kpi_cache[key]["used"])[-SETTINGS.KPI_CACHE_SIZE:]
+        kpi_cache = {key: kpi_cache[key] for key in kept_keys}
+    SETTINGS.OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
+    get_kpi_cache_path().write_text(json.dumps(kpi_cache))
+
+
+def get_cached(kpi_cache: dict[str, dict], key: str) -> dict | None:
+    entry = kpi_cache[key]
+    entry["used"] = time.time()
+    return entry["value"]
+
+
+def set_cached(kpi_cache: dict[str, dict], key: str, value: dict | None) -> None:
+    kpi_cache[key] = {"value": value, "used": time.time()}
+
+
+def get_part_hash(kpi_cache: dict[str, dict], part: Path) -> str:
+    """
+    Content hash of a part of a parsed file, kept in the KPI cache with the size and mtime it was taken at.
+    """
+    stat = part.stat()
+    key = f"part:{part.resolve()}"
+    previous_entry = get_cached(kpi_cache=kpi_cache, key=key) if key in kpi_cache else {}
+    # Only re-hash parts that were touched since they were hashed
+    if previous_entry.get("size") == stat.st_size and previous_entry.get("mtime_ns") == stat.st_mtime_ns:
+        return previous_entry["hash"]
+    content_hash = hash_file(part)
+    set_cached(
+        kpi_cache=kpi_cache,
+        key=key,
+        value={"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": content_hash},
+    )
+    return content_hash
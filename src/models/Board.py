@@ -0,0 +1,65 @@
+from dataclasses import dataclass
+from itertools import combinations
+
+from src.models.Card import ALL_RANKS_MASK, CARDS, Rank, Suit, get_cards_mask
+
+
+def get_rank_bit(card: str) -> int:
+    return 1 << (CARDS[card].rank.value - Rank.TWO.value)
+
+
+def get_nut_flush_ranks(board_mask: int) -> list[int]:
+    """
+    Rank bits a hand needs for the nut, 2nd nut and 3rd nut flush draw of a suit, given the ranks of that suit on the board.
+    The nut rank is the highest rank missing from the board. The 3rd nut only counts when the 2nd nut rank is not on the board.
+    """
+    nut_rank = 1 << ((~board_mask & ALL_RANKS_MASK).bit_length() - 1)
+    second_nut_rank = nut_rank >> 1
+    third_nut_rank = nut_rank >> 2 if not board_mask & second_nut_rank else 0
+    return [nut_rank, second_nut_rank, third_nut_rank]
+
+
+@dataclass
+class BoardCombo:
+    cards: tuple[str, ...]
+    mask: int
+    rank_mask: int
+    suit_masks: dict[Suit, int]
+    suit_counts: dict[Suit, int]
+    nut_flush_ranks: dict[Suit, list[int]]
+
+    @classmethod
+    def from_cards(cls, cards: tuple[str, ...]) -> "BoardCombo":
+        suit_masks = {suit: 0 for suit in Suit}
+        for card in cards:
+            suit_masks[CARDS[card].suit] |= get_rank_bit(card)
+        rank_mask = 0
+        for suit_mask in suit_masks.values():
+            rank_mask |= suit_mask
+        return cls(
+            cards=cards,
+            mask=get_cards_mask(list(cards)),
+            rank_mask=rank_mask,
+            suit_masks=suit_masks,
+            suit_counts={suit: suit_mask.bit_count() for suit, suit_mask in suit_masks.items()},
+            nut_flush_ranks={suit: get_nut_flush_ranks(suit_mask) for suit, suit_mask in suit_masks.items()},
+        )
+
+
+@dataclass
+class Board:
+    """
+    Everything about the community cards that is the same for every row of a file, computed once per file.
+    Omaha plays exactly three community cards, so the features are kept per three card combo.
+    """
+    cards: list[str]
+    card_ids: list[int]
+    combos: list[BoardCombo]
+
+    @classmethod
+    def from_cards(cls, cards: list[str]) -> "Board":
+        return cls(
+            cards=cards,
+            card_ids=[CARDS[card].id for card in cards],
+            combos=[BoardCombo.from_cards(combo) for combo in combinations(cards, 3)],
+        )
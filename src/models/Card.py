@@ -37,6 +37,26 @@ class Card:
     def __repr__(self):
         return self.raw
 
+    @property
+    def id(self) -> int:
+        """
+        Cards are numbered 0-51 suit by suit, so every suit owns 13 consecutive bits of a hand mask.
+        """
+        return list(Suit).index(self.suit) * RANK_COUNT + self.rank.value - Rank.TWO.value
+
+    @property
+    def mask(self) -> int:
+        return 1 << self.id
+
+
+RANK_COUNT = len(Rank)
+RANK_ORDER = "23456789TJQKA"
+ALL_RANKS_MASK = (1 << RANK_COUNT) - 1
+# Rank counts pack how many cards there are of every rank, four bits per rank with the top bit kept free as a guard
+RANK_COUNT_BITS = 4
+RANK_COUNTS_GUARD = sum(1 << (RANK_COUNT_BITS * rank + RANK_COUNT_BITS - 1) for rank in range(RANK_COUNT))
+HOLE_CARD_COUNT = 4
+
 
 CARDS = {
     "Ah": Card(suit=Suit.HEARTS, rank=Rank.ACE, raw="Ah"),
@@ -92,3 +112,31 @@ CARDS = {
     "Qs": Card(suit=Suit.SPADES, rank=Rank.QUEEN, raw="Qs"),
     "Ks": Card(suit=Suit.SPADES, rank=Rank.KING, raw="Ks"),
 }
+
+CARD_IDS = {raw: card.id for raw, card in CARDS.items()}
+CARD_NAMES = {card_id: raw for raw, card_id in CARD_IDS.items()}
+
+
+def get_cards_mask(cards: list[str]) -> int:
+    mask = 0
+    for card in cards:
+        mask |= CARDS[card].mask
+    return mask
+
+
+def get_rank_counts(ranks: str) -> int:
+    rank_counts = 0
+    for rank in ranks:
+        if rank not in RANK_ORDER:
+            raise ValueError(f"Invalid rank {rank} in {ranks}, expected one of {RANK_ORDER}")
+        rank_counts += 1 << (RANK_COUNT_BITS * RANK_ORDER.index(rank))
+    if len(ranks) > HOLE_CARD_COUNT:
+        raise ValueError(f"Ranks {ranks} have more than {HOLE_CARD_COUNT} cards")
+    return rank_counts
+
+
+def split_cards(cards: str) -> list[str]:
+    split = [cards[start:start + 2] for start in range(0, len(cards), 2)]
+    if not split or any(card not in CARDS for card in split):
+        raise ValueError(f"Invalid cards: {cards}")
+    return split
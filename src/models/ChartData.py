@@ -0,0 +1,20 @@
+from dataclasses import dataclass
+
+import numpy
+
+
+@dataclass
+class ChartData:
+    """
+    Share of every action for every KPI, one row of values per label and one column per action.
+    """
+    labels: list[str]
+    actions: list[str]
+    values: numpy.ndarray
+
+    def select_actions(self, actions: list[str]) -> "ChartData":
+        """
+        The columns of the given actions, in the given order. Actions the chart does not have are left out.
+        """
+        columns = [self.actions.index(action) for action in actions if action in self.actions]
+        return ChartData(labels=self.labels, actions=[self.actions[column] for column in columns], values=self.values[:, columns])
@@ -2,6 +2,7 @@ from itertools import combinations
 from pathlib import Path
 
 from src.models.Action import Action
+from src.models.Board import Board
 
 
 class File:
@@ -11,6 +12,7 @@ class File:
         self.cards = self.parse_cards(cards_raw)
         action_raw = action_raw.casefold().replace("raise", "bet")
         self.action = Action(action_raw)
+        self.board = Board.from_cards(self.cards)
 
     def __str__(self):
         return f"File(path={self.path}, cards={self.cards}, action={self.action})"
@@ -22,3 +24,11 @@ class File:
     @property
     def combos(self):
         return list(combinations(self.cards, 3))
+
+    @property
+    def card_ids(self) -> list[int]:
+        return self.board.card_ids
+
+    @property
+    def combo_masks(self) -> list[int]:
+        return [combo.mask for combo in self.board.combos]
@@ -7,6 +7,8 @@ class InputColumn(StrEnum):
     COMMUNITY_CARDS = "community_cards"
     HOLE_CARDS = "hole_cards"
     HOLE_CARDS_RANKS = "hole_cards_ranks"
+    HOLE_CARDS_RANK_COUNTS = "hole_cards_rank_counts"
+    HOLE_CARDS_MASK = "hole_cards_mask"
     IS_FLUSH = "is_flush"
     IS_STRAIGHT = "is_straight"
     IS_STRAIGHT_FLUSH = "is_straight_flush"
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+import polars
+
+from logger import logger
+from src.bitmap_index import write_bitmap_index
+from src.dataset import write_dataset
+from src.models.Card import CARD_NAMES
+from src.settings import SETTINGS
+
+CARD_COLUMNS = ["community_cards", "hole_cards"]
+
+_output_writers: list[threading.Thread] = []
+_output_errors: list[Exception] = []
+
+
+def get_csv_column(column: str, dtype: polars.DataType) -> polars.Expr:
+    """
+    CSV has no nested values, so cards are written by name and other lists joined with commas.
+    """
+    expression = polars.col(column)
+    if isinstance(dtype, polars.Array):
+        expression = expression.arr.to_list()
+        dtype = polars.List(dtype.inner)
+    if column in CARD_COLUMNS:
+        return expression.list.eval(
+            polars.element().replace_strict(CARD_NAMES, return_dtype=polars.String)
+        ).list.join(",")
+    if isinstance(dtype, polars.List):
+        return expression.cast(polars.List(polars.String)).list.join(",")
+    return expression
+
+
+def save_to_csv(dataframe: polars.DataFrame | polars.LazyFrame, filename: str) -> None:
+    # Every column is flattened in a single projection
+    dataframe = dataframe.lazy().select(
+        get_csv_column(column=column, dtype=dtype) for column, dtype in dataframe.collect_schema().items()
+    )
+    dataframe.sink_csv(filename)
+
+
+def save_to_ipc(dataframe: polars.DataFrame | polars.LazyFrame, filename: str) -> None:
+    """
+    Uncompressed, so readers can memory map the columns as they are on disk.
+    Written under a temporary name first, so a reader never maps a file that is still being written.
+    """
+    dataframe.lazy().sink_ipc(f"{filename}.tmp", compression="uncompressed")
+    os.replace(f"{filename}.tmp", filename)
+
+
+def write_outputs(dataframe: polars.DataFrame | polars.LazyFrame, filename: str, save_parquet: bool) -> None:
+    """
+    Writes the parsed result to every enabled sink on a background thread, so charts are drawn in the meantime.
+    The bitmap index goes next to the parquet file, so it is only written when there is one.
+    """
+    def write() -> None:
+        start = time.time()
+        try:
+            if save_parquet:
+                dataframe.lazy().sink_parquet(f"{filename}.parquet")
+            if SETTINGS.SAVE_BITMAP_INDEX and Path(f"{filename}.parquet").exists():
+                write_bitmap_index(Path(f"{filename}.parquet"))
+            if SETTINGS.SAVE_CACHE_COPY_AS_CSV:
+                save_to_csv(dataframe=dataframe, filename=f"{filename}.csv")
+            if SETTINGS.SAVE_CACHE_COPY_AS_IPC:
+                save_to_ipc(dataframe=dataframe, filename=f"{filename}.arrow")
+            if SETTINGS.SAVE_DATASET:
+                write_dataset(dataframe)
+        except Exception as error:
+            logger.exception(f"Failed writing outputs of: {filename}")
+            _output_errors.append(error)
+            return
+        logger.debug(f"Outputs of {filename} written in {time.time() - start:.2f} seconds")
+
+    # Not a daemon, so the process does not exit halfway through a write
+    output_writer = threading.Thread(target=write, name=f"output-writer-{len(_output_writers)}")
+    output_writer.start()
+    _output_writers.append(output_writer)
+
+
+def wait_for_outputs() -> None:
+    """
+    Waits for every output writer, then raises the first error any of them ran into, so a run never ends
+    successfully with outputs missing.
+    """
+    while _output_writers:
+        _output_writers.pop().join()
+    if _output_errors:
+        error = _output_errors[0]
+        _output_errors.clear()
+        raise error
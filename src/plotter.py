@@ -1,62 +1,48 @@
 from pathlib import Path
 
 import matplotlib.pyplot as plt
-import pandas
+import numpy
 
 from src.analyzer import get_chart_data
+from src.models.ChartData import ChartData
 
 
-def plot_chart_data(chart_data: pandas.DataFrame,
+def plot_chart_data(chart_data: ChartData,
                     kind: str,
                     title: str,
                     xlabel: str,
                     ylabel: str,
                     colors: dict,
                     show_legend: bool):
-    merged = pandas.DataFrame()
-    for column in chart_data.columns:
-        series = pandas.Series(chart_data[column][0])
-        merged[column] = series
-    merged = merged.transpose()
-    merged = merged.reindex(colors.keys(), axis=1)
-    merged = merged.dropna(axis=1, how="all")
-    plot_kwargs = {
-        "kind": kind,
-        "xlabel": xlabel,
-        "ylabel": ylabel,
-        "color": [colors[col] for col in merged.columns],
-        "figsize": (10, 6),
-        "rot": 0,
-    }
+    # Actions in the order of their colors, leaving out those without a single value
+    chart_data = chart_data.select_actions(list(colors.keys()))
+    shown = ~numpy.isnan(chart_data.values).all(axis=0)
+    chart_data = chart_data.select_actions([action for action, is_shown in zip(chart_data.actions, shown) if is_shown])
+    positions = numpy.arange(len(chart_data.labels))
+    _, ax = plt.subplots(figsize=(10, 6))
     if kind == "bar":
-        plot_kwargs["stacked"] = True
-    if kind == "line":
-        plot_kwargs["marker"] = "o"
-        plot_kwargs["markersize"] = 4
-        plot_kwargs["linestyle"] = "-"
-        plot_kwargs["linewidth"] = 1.5
-        plot_kwargs["markerfacecolor"] = "white"
-    ax = merged.plot(**plot_kwargs)
-    if kind == "bar":
-        for container in ax.containers:
-            labels = []
-            for rectangle in container:
-                rectangle.set_edgecolor("black")
-                rectangle.set_linewidth(1)
-                label = (
-                    f"{rectangle.get_height() * 100:.1f}%"
-                    if f"{rectangle.get_height() * 100:.1f}%" != "0.0%"
-                    else ""
-                )
-                labels.append(label)
+        bottom = numpy.zeros(len(chart_data.labels))
+        for action, values in zip(chart_data.actions, numpy.nan_to_num(chart_data.values).T):
+            container = ax.bar(
+                positions, values, width=0.5, bottom=bottom, color=colors[action], label=action,
+                edgecolor="black", linewidth=1,
+            )
+            bottom += values
+            labels = [
+                f"{rectangle.get_height() * 100:.1f}%" if f"{rectangle.get_height() * 100:.1f}%" != "0.0%" else ""
+                for rectangle in container
+            ]
             ax.bar_label(container, labels=labels, label_type="center", fontsize=8)
+        ax.set_xlim(-0.5, len(chart_data.labels) - 0.5)
     elif kind == "line":
         plt.grid(True)
-        for line in ax.lines:
-            x_data = line.get_xdata()
-            y_data = line.get_ydata()
-            for x, y in zip(x_data, y_data):
-                if not pandas.isna(y):
+        for action, values in zip(chart_data.actions, chart_data.values.T):
+            ax.plot(
+                positions, values, color=colors[action], label=action,
+                marker="o", markersize=4, linestyle="-", linewidth=1.5, markerfacecolor="white",
+            )
+            for x, y in zip(positions, values):
+                if not numpy.isnan(y):
                     ax.annotate(
                         f"{y * 100:.0f}%",
                         xy=(x, y),
@@ -65,6 +51,9 @@ def plot_chart_data(chart_data: pandas.DataFrame,
                         ha="center",
                         fontsize=8,
                     )
+    ax.set_xticks(positions, chart_data.labels)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
     plt.xticks(rotation=0)
     plt.gca().yaxis.set_major_formatter(
         plt.FuncFormatter(lambda x, _: f"{int(x * 100)}%")
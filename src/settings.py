@@ -18,6 +18,17 @@ class Settings(BaseModel):
     LOG_TO_FILE: Optional[bool] = False
     SAVE_CACHE: Optional[bool] = False
     SAVE_CACHE_COPY_AS_CSV: Optional[bool] = False
+    SAVE_CACHE_COPY_AS_IPC: Optional[bool] = False
+    STREAM_INPUT_FILES: Optional[bool] = False
+    USE_FILE_CACHE: Optional[bool] = False
+    FAST_EXPORT_PARSER: Optional[bool] = False
+    FUSED_EVALUATION: Optional[bool] = False
+    SAVE_BITMAP_INDEX: Optional[bool] = False
+    KPI_CACHE: Optional[bool] = False
+    KPI_CACHE_SIZE: Optional[int] = 1000
+    SAVE_DATASET: Optional[bool] = False
+    DATASET_ROW_GROUP_SIZE: Optional[int] = 32768
+    STARTUP_TIME_BUDGET: Optional[float] = 0.5
     TIMESTAMP: Optional[str] = ""
     TIMESTAMP_LABEL: Optional[str] = ""
     INPUT_FILE_REGEX: Optional[re.Pattern] = re.compile(r"([2-9tjqka][hdcs]){3,5}_(call|fold|raise|check|bet|bet[0-9]{1,3})\.txt")
@@ -0,0 +1,42 @@
+import random
+from pathlib import Path
+
+import pytest
+
+from src.models.Card import CARD_IDS, split_cards
+from src.settings import SETTINGS
+
+BOARD = "Ah7h2c"
+
+
+def write_export(folder: Path, action: str, rows: int = 300) -> Path:
+    """
+    A solver export of random hole cards and weights for an action on BOARD, the same for every run.
+    """
+    generator = random.Random(action)
+    deck = [card for card in CARD_IDS if card not in split_cards(BOARD)]
+    lines = [f"{generator.randint(1, 1000) / 1000}:{''.join(generator.sample(deck, 4))}" for _ in range(rows)]
+    path = folder / f"{BOARD}_{action}.txt"
+    path.write_text("\n".join(lines) + "\n")
+    return path
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch) -> tuple[Path, Path]:
+    """
+    Empty input and output folders, with every optional cache and sidecar turned off and parsed files saved.
+    """
+    input_folder = tmp_path / "input"
+    output_folder = tmp_path / "output"
+    input_folder.mkdir()
+    output_folder.mkdir()
+    monkeypatch.setattr(SETTINGS, "INPUT_FOLDER", input_folder)
+    monkeypatch.setattr(SETTINGS, "OUTPUT_FOLDER", output_folder)
+    monkeypatch.setattr(SETTINGS, "TIMESTAMP_LABEL", "test")
+    monkeypatch.setattr(SETTINGS, "SAVE_CACHE", True)
+    for setting in [
+        "MOVE_FILES_TO_PROCESSED_FOLDER", "SAVE_CACHE_COPY_AS_CSV", "SAVE_CACHE_COPY_AS_IPC", "STREAM_INPUT_FILES",
+        "USE_FILE_CACHE", "FUSED_EVALUATION", "SAVE_BITMAP_INDEX", "KPI_CACHE", "SAVE_DATASET",
+    ]:
+        monkeypatch.setattr(SETTINGS, setting, False)
+    return input_folder, output_folder
@@ -0,0 +1,169 @@
+from collections import Counter
+from itertools import combinations_with_replacement
+
+import polars
+import pytest
+from polars.testing import assert_frame_equal
+
+from src.analyzer import (
+    get_batch_chart_data,
+    get_includes_condition,
+    get_kpi_condition,
+    get_kpi_results,
+    get_kpi_table,
+    get_requirement_condition,
+)
+from src.bitmap_index import BitmapIndex
+from src.input_reader import (
+    ACTION_DTYPE,
+    BEST_HAND_DTYPE,
+    append_input_files,
+    get_parsed_files,
+    read_input_files,
+    scan_parsed_file,
+)
+from src.models.Card import CARD_IDS, HOLE_CARD_COUNT, RANK_ORDER, get_rank_counts, split_cards
+from src.models.InputColumn import InputColumn
+from src.models.KPI import KPI, KPIOperation, KPIRequirement
+from src.output_writer import wait_for_outputs
+from src.settings import SETTINGS
+from tests.conftest import write_export
+
+KPIS = [
+    KPI(display_name="Ace", requirements=[
+        KPIRequirement(column=InputColumn.HOLE_CARDS_RANKS, operation=KPIOperation.INCLUDES, value="A"),
+    ]),
+    KPI(display_name="Pair", requirements=[
+        KPIRequirement(column=InputColumn.IS_PAIR, operation=KPIOperation.EQUALS, value=True),
+    ]),
+    KPI(display_name="Rest", requirements=[
+        KPIRequirement(column=InputColumn.BEST_HAND_VALUE, operation=KPIOperation.GREATER_THAN_OR_EQUALS, value=1),
+    ]),
+]
+HANDS = ["".join(ranks) for ranks in combinations_with_replacement(reversed(RANK_ORDER), HOLE_CARD_COUNT)]
+
+
+def get_hands(with_rank_counts: bool) -> polars.DataFrame:
+    dataframe = polars.DataFrame({InputColumn.HOLE_CARDS_RANKS: HANDS})
+    if with_rank_counts:
+        dataframe = dataframe.with_columns(
+            polars.Series(InputColumn.HOLE_CARDS_RANK_COUNTS, [get_rank_counts(hand) for hand in HANDS], dtype=polars.UInt64)
+        )
+    return dataframe
+
+
+@pytest.mark.parametrize("with_rank_counts", [True, False], ids=["rank_counts", "count_matches"])
+@pytest.mark.parametrize("value", ["A", "AK", "KA", "QQ", "QQQ", "AAAA", "T982", "22", "2345", "JJT"])
+def test_hole_cards_ranks_includes(with_rank_counts, value):
+    dataframe = get_hands(with_rank_counts)
+    requirement = KPIRequirement(column=InputColumn.HOLE_CARDS_RANKS, operation=KPIOperation.INCLUDES, value=value)
+    matches = dataframe.select(get_includes_condition(schema=dataframe.schema, requirement=requirement)).to_series()
+    # A hand matches when it holds at least as many cards of every rank as the value
+    expected = [not Counter(value) - Counter(hand) for hand in HANDS]
+    assert matches.to_list() == expected
+
+
+@pytest.mark.parametrize("value", ["AX", "AAAAA", ".*"])
+def test_hole_cards_ranks_includes_rejects_invalid_values(value):
+    dataframe = get_hands(with_rank_counts=True)
+    requirement = KPIRequirement(column=InputColumn.HOLE_CARDS_RANKS, operation=KPIOperation.INCLUDES, value=value)
+    with pytest.raises(ValueError):
+        get_includes_condition(schema=dataframe.schema, requirement=requirement)
+
+
+@pytest.mark.parametrize("operation", [KPIOperation.INCLUDES, KPIOperation.NOT_INCLUDES])
+def test_enum_column_includes(operation):
+    labels = ["Flush", "Straight Flush", "One Pair", "Two Pair", "High Card"]
+    dataframe = polars.DataFrame({InputColumn.BEST_HAND: polars.Series(labels, dtype=BEST_HAND_DTYPE)})
+    requirement = KPIRequirement(column=InputColumn.BEST_HAND, operation=operation, value="Flush")
+    matches = dataframe.select(get_requirement_condition(schema=dataframe.schema, requirement=requirement)).to_series()
+    expected = ["Flush" in label for label in labels]
+    assert matches.to_list() == (expected if operation == KPIOperation.INCLUDES else [not match for match in expected])
+
+
+@pytest.mark.parametrize(
+    "column, value",
+    [(InputColumn.BEST_HAND, "Pair"), (InputColumn.ACTION, "raise")],
+)
+def test_enum_column_unknown_label(column, value):
+    dataframe = polars.DataFrame({
+        InputColumn.BEST_HAND: polars.Series(["One Pair"], dtype=BEST_HAND_DTYPE),
+        InputColumn.ACTION: polars.Series(["bet"], dtype=ACTION_DTYPE),
+    })
+    kpi = KPI(display_name="Typo", requirements=[
+        KPIRequirement(column=column, operation=KPIOperation.EQUALS, value=value),
+    ])
+    with pytest.raises(ValueError, match="Typo"):
+        get_kpi_condition(schema=dataframe.schema, kpi=kpi)
+
+
+@pytest.mark.parametrize("operation", [KPIOperation.INCLUDES, KPIOperation.NOT_INCLUDES])
+@pytest.mark.parametrize("value", ["As", "Ah7h", "Kd"])
+def test_community_cards_includes(operation, value):
+    boards = ["Ah7h2c", "As7h2c", "AsAh7h", "KdQdJd"]
+    dataframe = polars.DataFrame(
+        {InputColumn.COMMUNITY_CARDS: [[CARD_IDS[card] for card in split_cards(board)] for board in boards]},
+        schema={InputColumn.COMMUNITY_CARDS: polars.List(polars.UInt8)},
+    )
+    requirement = KPIRequirement(column=InputColumn.COMMUNITY_CARDS, operation=operation, value=value)
+    matches = dataframe.select(get_requirement_condition(schema=dataframe.schema, requirement=requirement)).to_series()
+    expected = [all(card in split_cards(board) for card in split_cards(value)) for board in boards]
+    assert matches.to_list() == (expected if operation == KPIOperation.INCLUDES else [not match for match in expected])
+
+
+def test_batch_matches_file(folders, monkeypatch):
+    input_folder, output_folder = folders
+    monkeypatch.setattr(SETTINGS, "KPIS", KPIS)
+    monkeypatch.setattr(SETTINGS, "SAVE_DATASET", True)
+    write_export(input_folder, "call")
+    write_export(input_folder, "fold")
+    read_input_files()
+    wait_for_outputs()
+    parsed_file = next(output_folder.glob("parsed_*.parquet"))
+    # Appending leaves the actions parsed before, and adds the new one as a fragment
+    write_export(input_folder, "bet33")
+    append_input_files(parsed_file=parsed_file)
+    wait_for_outputs()
+
+    # Batch leaves out the actions a KPI has no weight for
+    expected = get_kpi_table(file=parsed_file).filter(polars.col("weight") > 0).sort(["kpi_name", "action"])
+    for pattern in [parsed_file, output_folder / "dataset", output_folder / "**" / "*.parquet"]:
+        batch = get_batch_chart_data(pattern=str(pattern), kpis=KPIS)
+        assert batch["board"].unique().to_list() == ["Ah7h2c"]
+        assert_frame_equal(batch.drop("board").sort(["kpi_name", "action"]), expected, check_dtypes=False)
+
+
+def test_bitmap_index_matches_scan(folders, monkeypatch):
+    input_folder, output_folder = folders
+    monkeypatch.setattr(SETTINGS, "SAVE_BITMAP_INDEX", True)
+    write_export(input_folder, "call")
+    write_export(input_folder, "fold")
+    read_input_files()
+    wait_for_outputs()
+    parsed_file = next(output_folder.glob("parsed_*.parquet"))
+    write_export(input_folder, "bet33")
+    append_input_files(parsed_file=parsed_file)
+    wait_for_outputs()
+    assert all(BitmapIndex.load(part) is not None for part in get_parsed_files(parsed_file))
+
+    kpis = [
+        KPI(display_name="Nut draw", requirements=[
+            KPIRequirement(column=InputColumn.FLUSH_DRAW, operation=KPIOperation.INCLUDES, value="Nut"),
+        ]),
+        KPI(display_name="Bet pair", requirements=[
+            KPIRequirement(column=InputColumn.ACTION, operation=KPIOperation.EQUALS, value="bet33"),
+            KPIRequirement(column=InputColumn.IS_PAIR, operation=KPIOperation.EQUALS, value=True),
+        ]),
+        *KPIS,
+    ]
+    index_actions, index_total, index_weights = get_kpi_results(
+        dataframe=scan_parsed_file(parsed_file), file=parsed_file, kpis=kpis
+    )
+    # Without a file the KPIs are answered by scanning the rows
+    scan_actions, scan_total, scan_weights = get_kpi_results(dataframe=scan_parsed_file(parsed_file), file=None, kpis=kpis)
+    assert sorted(index_actions) == sorted(scan_actions)
+    assert index_total == pytest.approx(scan_total)
+    assert index_weights.keys() == scan_weights.keys()
+    for kpi_index, weights in index_weights.items():
+        for action in index_actions:
+            assert weights.get(action, 0) == pytest.approx(scan_weights[kpi_index].get(action, 0), abs=1e-3)
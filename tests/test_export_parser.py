@@ -0,0 +1,55 @@
+import polars
+import pytest
+
+from src.export_parser import parse_export
+from src.input_reader import read_file, split_export_lines
+from src.models.File import File
+from src.settings import SETTINGS
+
+
+def read_with_csv(path):
+    return split_export_lines(polars.read_csv(path, has_header=False))
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"0.25:AhKdQc2s\n1:2h3h4h5h\n",
+        b"0.25:AhKdQc2s\r\n1:2h3h4h5h\r\n",
+        b"0.25:AhKdQc2s\n0.5:Td9d8c7c",
+        b"12.5:AhKdQc2s\n0.001:2h3h4h5h\n7:TsJsQsKs\n100:As2s3d4d\n",
+    ],
+    ids=["lf", "crlf", "no_trailing_newline", "mixed_weights"],
+)
+def test_parse_export_matches_csv_reader(tmp_path, data):
+    path = tmp_path / "Ah7h2c_call.txt"
+    path.write_bytes(data)
+    assert parse_export(path).equals(read_with_csv(path))
+
+
+def test_parse_export_skips_blank_lines(tmp_path):
+    # The CSV reader gives blank lines a row of nulls, the parser leaves them out
+    path = tmp_path / "Ah7h2c_call.txt"
+    path.write_bytes(b"0.25:AhKdQc2s\n\n1:2h3h4h5h\r\n\r\n")
+    assert parse_export(path).equals(read_with_csv(path).drop_nulls())
+
+
+def test_parse_export_head(tmp_path):
+    path = tmp_path / "Ah7h2c_call.txt"
+    path.write_bytes(b"0.25:AhKdQc2s\n1:2h3h4h5h\n0.5:Td9d8c7c\n")
+    assert parse_export(path, head=2).equals(read_with_csv(path).head(2))
+
+
+@pytest.mark.parametrize(
+    "data",
+    [b"1e-3:AhKdQc2s\n", b"abc:AhKdQc2s\n", b"0.25:AhKdQc2x\n", b"0.25;AhKdQc2s\n", b"1.2.3:AhKdQc2s\n"],
+    ids=["exponent", "garbage_weight", "bad_suit", "bad_separator", "two_dots"],
+)
+def test_parse_export_falls_back_to_csv_reader(tmp_path, monkeypatch, data):
+    path = tmp_path / "Ah7h2c_call.txt"
+    path.write_bytes(data)
+    assert parse_export(path) is None
+
+    monkeypatch.setattr(SETTINGS, "FAST_EXPORT_PARSER", True)
+    dataframe = read_file(File(path)).select("weight", "hole_cards")
+    assert dataframe.equals(read_with_csv(path))
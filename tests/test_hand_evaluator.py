@@ -0,0 +1,71 @@
+from collections import Counter
+from itertools import combinations_with_replacement
+
+import numpy
+import pytest
+
+from src.hand_evaluator import (
+    HAND_FLAGS,
+    HAND_RANK_MASK,
+    HAND_RANKS,
+    HAND_SIZE,
+    RANK_WEIGHTS,
+    build_hand_table,
+    get_hand_rank_offset,
+    get_hand_table,
+    get_rank_key_table,
+)
+from src.models.Card import RANK_COUNT, RANK_ORDER, Suit
+
+
+def look_up_hand(ranks: str, is_flush: bool) -> dict[str, bool | int | None]:
+    record = int(get_hand_table()[sum(RANK_WEIGHTS[RANK_ORDER.index(rank)] for rank in ranks) * 2 + is_flush])
+    hand = {flag: bool(record >> index & 1) for index, flag in enumerate(HAND_FLAGS)}
+    for field in HAND_RANKS:
+        hand[field] = (record >> get_hand_rank_offset(field) & HAND_RANK_MASK) or None
+    return hand
+
+
+@pytest.mark.parametrize(
+    "ranks, is_flush, expected",
+    [
+        ("AKQJT", True, {"best_hand_value": 1, "is_straight_flush": True, "is_flush": True, "straight_rank": 14}),
+        ("AAAAK", False, {"best_hand_value": 2, "is_quads": True, "quads_rank": 14, "is_pair": False}),
+        ("KKKQQ", False, {
+            "best_hand_value": 3, "is_full_house": True, "set_rank": 13, "full_house_pair_rank": 12, "is_pair": False,
+        }),
+        ("AJ942", True, {"best_hand_value": 4, "is_flush": True, "is_straight": False}),
+        ("AKQJT", False, {"best_hand_value": 5, "is_straight": True, "is_straight_flush": False, "straight_rank": 14}),
+        ("65432", False, {"best_hand_value": 5, "is_straight": True, "straight_rank": 6}),
+        ("77752", False, {"best_hand_value": 6, "is_trips": True, "set_rank": 7, "pair_rank": None}),
+        ("KKQQ2", False, {"best_hand_value": 7, "is_two_pair": True, "is_pair": True, "pair_rank": 13}),
+        ("99A52", False, {"best_hand_value": 8, "is_pair": True, "is_two_pair": False, "pair_rank": 9}),
+        ("AJ942", False, {"best_hand_value": 9, "is_pair": False, "is_flush": False, "straight_rank": None}),
+    ],
+)
+def test_hand_table_known_hands(ranks, is_flush, expected):
+    hand = look_up_hand(ranks=ranks, is_flush=is_flush)
+    assert {field: hand[field] for field in expected} == expected
+
+
+def test_shipped_hand_table_is_up_to_date():
+    assert numpy.array_equal(get_hand_table(), build_hand_table())
+
+
+def test_rank_keys_are_unique():
+    # The weights are a perfect hash, no two rank multisets of a hand share a key
+    rank_keys = set()
+    for indices in combinations_with_replacement(range(RANK_COUNT), HAND_SIZE):
+        if max(Counter(indices).values()) > len(Suit):
+            continue
+        rank_key = sum(RANK_WEIGHTS[index] for index in indices)
+        assert rank_key not in rank_keys
+        rank_keys.add(rank_key)
+
+
+def test_rank_key_table():
+    rank_key_table = get_rank_key_table()
+    for rank_mask in range(1 << RANK_COUNT):
+        assert rank_key_table[rank_mask] == sum(
+            weight for index, weight in enumerate(RANK_WEIGHTS) if rank_mask >> index & 1
+        )
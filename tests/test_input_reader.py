@@ -0,0 +1,40 @@
+from polars.testing import assert_frame_equal
+
+from src.input_reader import append_input_files, get_fragment_folder, read_input_files, scan_parsed_file
+from src.output_writer import wait_for_outputs
+from src.settings import SETTINGS
+from tests.conftest import write_export
+
+SORT_COLUMNS = ["action", "hole_cards_mask", "weight"]
+
+
+def test_fused_evaluation_matches_exploded(folders, monkeypatch):
+    input_folder, _ = folders
+    monkeypatch.setattr(SETTINGS, "SAVE_CACHE", False)
+    write_export(input_folder, "call")
+    write_export(input_folder, "bet75")
+    exploded = read_input_files()
+    monkeypatch.setattr(SETTINGS, "FUSED_EVALUATION", True)
+    fused = read_input_files()
+    wait_for_outputs()
+    assert_frame_equal(fused.sort(SORT_COLUMNS), exploded.sort(SORT_COLUMNS))
+
+
+def test_append_adds_fragments(folders, monkeypatch):
+    input_folder, output_folder = folders
+    write_export(input_folder, "call")
+    write_export(input_folder, "fold")
+    read_input_files()
+    wait_for_outputs()
+    parsed_file = next(output_folder.glob("parsed_*.parquet"))
+
+    # The input folder still holds the exports parsed before, only the new action is appended
+    write_export(input_folder, "bet33")
+    append_input_files(parsed_file=parsed_file)
+    wait_for_outputs()
+    assert [path.name for path in get_fragment_folder(parsed_file).iterdir()] == ["bet33.parquet"]
+    appended = scan_parsed_file(parsed_file).collect()
+
+    monkeypatch.setattr(SETTINGS, "SAVE_CACHE", False)
+    parsed_at_once = read_input_files()
+    assert_frame_equal(appended.sort(SORT_COLUMNS), parsed_at_once.sort(SORT_COLUMNS))
@@ -0,0 +1,22 @@
+import os
+
+from src import kpi_cache
+from src.kpi_cache import get_part_hash
+
+
+def test_part_hash_is_reused_until_the_part_changes(tmp_path, monkeypatch):
+    hashed = []
+    hash_file = kpi_cache.hash_file
+    monkeypatch.setattr(kpi_cache, "hash_file", lambda path: hashed.append(path) or hash_file(path))
+    part = tmp_path / "parsed.parquet"
+    part.write_bytes(b"first")
+    cache = {}
+
+    first_hash = get_part_hash(kpi_cache=cache, part=part)
+    assert get_part_hash(kpi_cache=cache, part=part) == first_hash
+    assert hashed == [part]
+
+    part.write_bytes(b"second")
+    os.utime(part, ns=(part.stat().st_atime_ns, part.stat().st_mtime_ns + 1))
+    assert get_part_hash(kpi_cache=cache, part=part) != first_hash
+    assert hashed == [part, part]